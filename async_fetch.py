@@ -0,0 +1,87 @@
+import os
+import time
+import pickle
+import asyncio
+import requests as req
+from tqdm import tqdm
+
+class TokenBucket:
+    '''Allows on average rate acquisitions per second, with bursts of up to capacity'''
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens)/self.rate)
+
+def _load_partial(partial_fname, key):
+    '''Responses already saved by an interrupted sweep with the same key, as {index: response json}'''
+    try:
+        with open(partial_fname, 'rb') as f:
+            saved_key, done = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return {}
+    return done if saved_key == key else {}
+
+def _save_partial(partial_fname, key, done):
+    # Write to a temporary file and swap it in, so an interruption never leaves a truncated checkpoint
+    with open(partial_fname + '.tmp', 'wb') as f:
+        pickle.dump((key, done), f)
+    os.replace(partial_fname + '.tmp', partial_fname)
+
+async def _fetch_all(urls, done, concurrency, rate, timeout, on_done):
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate)
+
+    async def fetch(i):
+        async with semaphore:
+            await bucket.acquire()
+            res = await asyncio.to_thread(req.get, urls[i], timeout=timeout)
+            res.raise_for_status()
+            return i, res.json()
+
+    pending = [fetch(i) for i in range(len(urls)) if i not in done]
+    with tqdm(total=len(urls), initial=len(done)) as pbar:
+        for next_done in asyncio.as_completed(pending):
+            i, data = await next_done
+            done[i] = data
+            on_done()
+            pbar.update()
+
+def fetch_json(urls, concurrency=4, rate=5.0, partial_fname=None, key=None, save_every=10, timeout=60):
+    '''GET every url with at most concurrency requests in flight and at most rate requests per second, returning the
+    decoded JSON responses in the same order as urls. If partial_fname is given, completed responses are saved there every save_every
+    responses and when the sweep is interrupted, and a later call with the same key (and urls) only requests the missing ones.
+    The partial file is removed once every url has been fetched.'''
+    key = (key, tuple(urls))
+    done = _load_partial(partial_fname, key) if partial_fname is not None else {}
+    if done:
+        print(f'Resuming download, {len(done)} of {len(urls)} already fetched.')
+
+    def on_done():
+        if partial_fname is not None and len(done) % save_every == 0:
+            _save_partial(partial_fname, key, done)
+
+    try:
+        asyncio.run(_fetch_all(urls, done, concurrency, rate, timeout, on_done))
+    except BaseException:
+        if partial_fname is not None and done:
+            _save_partial(partial_fname, key, done)
+            print(f'Download interrupted, {len(done)} of {len(urls)} responses saved to {partial_fname}')
+        raise
+
+    if partial_fname is not None and os.path.exists(partial_fname):
+        os.remove(partial_fname)
+    return [done[i] for i in range(len(urls))]
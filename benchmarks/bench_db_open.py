@@ -0,0 +1,96 @@
+'''Compare startup time and peak memory of the two ways retreive_paleobiodb_data can open the occurrence database:
+copying it into memory (load_db_into_memory = True) or using it in place with a page cache and mmap.
+Each mode runs in a fresh process so that peak memory is measured independently. Run from the repository root:
+
+    python benchmarks/bench_db_open.py --intervals 90 --occs 50000
+
+Startup covers opening the database, checking that every interval table exists (as the download loop does),
+adding one new table and making it durable on disk.'''
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+
+def child(mode, fname, column_fname):
+    import spatialite as sqlite3
+    import sql_statements as sql
+    import wisereplication as wr
+    from paleobiodb_interface import rv
+
+    with open(column_fname) as f:
+        column = json.load(f)
+    new_table = synthetic.occurrences(1000, 100, rng=None)
+
+    start = time.perf_counter()
+    if mode == 'memory':
+        conn = sqlite3.connect(':memory:')
+        sql.load_db_from_file(conn, fname)
+    else:
+        conn = sqlite3.connect(fname)
+        sql.configure_disk_connection(conn, wr.db_cache_mb, wr.db_mmap_mb)
+    opened = time.perf_counter() - start
+
+    for interval in column:
+        conn.execute(sql.check_table_query.format(wr.tableName(interval[rv.NAME]))).fetchone()
+    conn.execute(sql.dropTableQuery.format('bench_new_table'))
+    conn.execute(sql.create_table_query.format('bench_new_table'))
+    conn.executemany(sql.insert_query.format('bench_new_table'), ((o[rv.ID], float(o[rv.LAT]), float(o[rv.LON]), o[rv.PRECISION],
+                                                                    o[rv.SPECIES], o[rv.GENUS], o[rv.FAMILY]) for o in new_table))
+    conn.commit()
+    if mode == 'memory':
+        sql.copy_tables_to_file(conn, fname, ['bench_new_table'])
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    print(json.dumps(dict(mode=mode, open_s=opened, startup_s=elapsed, peak_rss_mb=peak_rss_mb())))
+
+def peak_rss_mb():
+    '''Peak resident memory of this process. On Linux ru_maxrss carries over from the parent across exec, so VmHWM is preferred.'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024
+    except FileNotFoundError:
+        pass
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024/1024 if sys.platform == 'darwin' else peak/1024
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare in-memory and in-place database startup.')
+    parser.add_argument('--intervals', type=int, default=90, help='Number of interval tables. Default 90.')
+    parser.add_argument('--occs', type=int, default=20000, help='Occurrences per interval table. Default 20000.')
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'DB', 'COLUMN'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        fname = os.path.join(workdir, 'bench.sqlite')
+        column_fname = os.path.join(workdir, 'column.json')
+        column = synthetic.geologic_column(args.intervals)
+        with open(column_fname, 'w') as f:
+            json.dump(column, f)
+        print(f'Building synthetic database ({args.intervals} tables x {args.occs} occurrences)...')
+        synthetic.occurrence_database(fname, column, synthetic.occurrence_tables(column, args.occs, args.occs//5))
+        print(f'Database size: {os.path.getsize(fname)/1024/1024:.1f} MB')
+
+        for mode in ['memory', 'in-place']:
+            out = subprocess.run([sys.executable, __file__, '--child', mode, fname, column_fname], capture_output=True, text=True, check=True)
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f'{mode:>9}: open {res["open_s"]*1000:.1f} ms, startup {res["startup_s"]*1000:.1f} ms, peak RSS {res["peak_rss_mb"]:.1f} MB')
+
+if __name__ == '__main__':
+    main()
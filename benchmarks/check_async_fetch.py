@@ -0,0 +1,104 @@
+'''Check async_fetch.fetch_json against a local mock of the Macrostrat API. No network access is needed. Run from the repository root:
+
+    python benchmarks/check_async_fetch.py --requests 20 --rate 5 --concurrency 10
+
+Checks that responses come back in url order, that an interrupted sweep saves its progress and a second sweep only requests
+the missing urls, and that requests never go out faster than --rate. Exits with status 1 if any check fails.'''
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_fetch
+
+class MockServer(http.server.ThreadingHTTPServer):
+    '''Answers /units?i=<n> with {"i": n} after delay seconds, and with an error for i in failing. Records the time of every request.'''
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.failing = set()
+        self.hits = []
+        super().__init__(('127.0.0.1', 0), MockHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def urls(self, n):
+        return [f'http://127.0.0.1:{self.server_port}/units?i={i}' for i in range(n)]
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits.append(time.monotonic())
+        i = int(self.path.split('=')[1])
+        time.sleep(self.server.delay)
+        if i in self.server.failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({'i': i}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def check_order(server, n, concurrency, rate):
+    responses = async_fetch.fetch_json(server.urls(n), concurrency, rate)
+    return [res['i'] for res in responses] == list(range(n))
+
+def check_resume(server, n, concurrency, rate, workdir):
+    partial_fname = os.path.join(workdir, 'sweep.partial')
+    server.failing = {n//2}
+    try:
+        async_fetch.fetch_json(server.urls(n), concurrency, rate, partial_fname=partial_fname, key='check', save_every=1)
+        return False
+    except Exception:
+        pass
+    finally:
+        server.failing = set()
+    if not os.path.exists(partial_fname):
+        return False
+
+    saved = len(async_fetch._load_partial(partial_fname, ('check', tuple(server.urls(n)))))
+    server.hits.clear()
+    responses = async_fetch.fetch_json(server.urls(n), concurrency, rate, partial_fname=partial_fname, key='check')
+    return (saved > 0 and len(server.hits) == n - saved and [res['i'] for res in responses] == list(range(n))
+            and not os.path.exists(partial_fname))
+
+def measured_rate(server, n, concurrency, rate):
+    '''Requests per second seen by the server over a sweep of n urls'''
+    server.hits.clear()
+    async_fetch.fetch_json(server.urls(n), concurrency, rate)
+    return (len(server.hits) - 1)/(max(server.hits) - min(server.hits))
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check the concurrent Macrostrat fetcher against a local mock server.')
+    parser.add_argument('--requests', type=int, default=20, help='Number of urls per sweep. Default 20.')
+    parser.add_argument('--rate', type=float, default=5.0, help='Requests per second allowed. Default 5.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Simultaneous requests. Default 10.')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='Fractional excess over --rate accepted as timing noise. Default 0.05.')
+    args = parser.parse_args()
+
+    server = MockServer()
+    with tempfile.TemporaryDirectory() as workdir:
+        checks = {'order': check_order(server, args.requests, args.concurrency, 100.0),
+                  'resume': check_resume(server, args.requests, args.concurrency, 100.0, workdir)}
+    observed = measured_rate(server, args.requests, args.concurrency, args.rate)
+    checks['rate'] = observed <= args.rate*(1 + args.tolerance)
+    server.shutdown()
+
+    print(f'Observed {observed:.2f} requests per second with --rate {args.rate} and --concurrency {args.concurrency}')
+    for name, passed in checks.items():
+        print(f'  {name}: {"ok" if passed else "FAILED"}')
+    if not all(checks.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
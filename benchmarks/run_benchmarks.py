@@ -0,0 +1,237 @@
+'''Time the main processing steps on synthetic data at several scales and append the results to a history file.
+No network access is needed. Run from the repository root:
+
+    python benchmarks/run_benchmarks.py --scales small medium
+
+Each run is compared with earlier runs in the history and cases which have slowed down by more than --threshold are reported.'''
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+from paleobiodb_interface import rv
+
+history_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.jsonl')
+
+# Problem sizes for each scale
+scales = {
+    'small':  dict(intervals=10, occs=500, taxa=200, sections=2000, columns=200, frames=20),
+    'medium': dict(intervals=30, occs=5000, taxa=2000, sections=20000, columns=1000, frames=50),
+    'large':  dict(intervals=90, occs=20000, taxa=10000, sections=100000, columns=3000, frames=100),
+}
+
+def timed(func, repeat):
+    '''Best wall time of repeat calls to func'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_filter_sections(size, repeat):
+    import sequences
+
+    sections = synthetic.macrostrat_sections(size['sections'])
+    results = {}
+    for overlap_type in ['intersect', 'initiate', 'truncate', 'endemic', 'through', 'xupper', 'xlower']:
+        results[f'filter_sections[{overlap_type}]'] = timed(lambda: sequences.filter_sections(sections, overlap_type, True, 200.0, 206.0), repeat)
+    return results
+
+def bench_boundaries(size, repeat, workdir):
+    import wisereplication as wr
+
+    column = synthetic.geologic_column(size['intervals'])
+    tables = synthetic.occurrence_tables(column, size['occs'], size['taxa'])
+    wr.database_filename = os.path.join(workdir, 'bench.sqlite')
+
+    results = {}
+    def crossers():
+        # Crossing tables and saved boundary results are reused by later runs, so start from a fresh database each time
+        if os.path.exists(wr.database_filename):
+            os.remove(wr.database_filename)
+        synthetic.occurrence_database(wr.database_filename, column, tables)
+        start = time.perf_counter()
+        wr.find_bounary_crossers(column)
+        return time.perf_counter() - start
+    results['find_bounary_crossers'] = min(crossers() for _ in range(repeat))
+
+    result = {id: dict(res) for id, res in wr.find_bounary_crossers(column).items()}
+    results['overlap_statistics'] = timed(lambda: wr.overlap_statistics(column, result), repeat)
+    return results
+
+def bench_grid_preaggregation(size, repeat, workdir):
+    '''copyQuery against the grid pre-aggregated statements and the tiled join on two dense, clustered intervals with many occurrences at the same localities'''
+    import spatialite as sqlite3
+    import sql_statements as sql
+    import wisereplication as wr
+    import tiling
+
+    column = synthetic.geologic_column(2)
+    tables = synthetic.occurrence_tables(column, size['occs']*4, size['taxa']//4, turnover=0.1, n_clusters=20, spread_deg=0.002)
+    fname = os.path.join(workdir, 'grid.sqlite')
+    tile_fname = os.path.join(workdir, 'tiles.sqlite')
+    synthetic.occurrence_database(fname, column, tables)
+    lower, upper = (wr.tableName(interval[rv.NAME]) for interval in column)
+
+    def run(copy):
+        with sqlite3.connect(fname) as conn:
+            for table in [lower + '_localcrossings', sql.gridTable(lower), sql.gridTable(upper)]:
+                conn.execute(sql.dropTableQuery.format(table))
+            tiling.reset_tiles(tile_fname)
+            start = time.perf_counter()
+            copy(conn)
+            elapsed = time.perf_counter() - start
+            return elapsed, conn.execute(sql.countQuery.format(lower + '_localcrossings')).fetchone()[0]
+
+    def statements(statements):
+        return lambda conn: [conn.execute(statement) for statement in statements]
+
+    def tiled(conn):
+        tiling.tiled_copy(conn.cursor(), lower + '_localcrossings', lower, upper, [lower], [upper], tile_fname, rv.ID, wr.taxon_field,
+                          wr.threshold_distance_deg, wr.tile_size_deg, wr.tile_processes)
+
+    exact = [run(statements([sql.copyQuery.format(newtable=lower + '_localcrossings', table1=lower, table2=upper)])) for _ in range(repeat)]
+    grid = [run(statements(sql.grid_copy_statements(lower + '_localcrossings', lower, upper))) for _ in range(repeat)]
+    tile = [run(tiled) for _ in range(repeat)]
+    if exact[0][1] != grid[0][1]:
+        raise RuntimeError(f'Grid pre-aggregation changed the crossing count: {exact[0][1]} != {grid[0][1]}')
+    if exact[0][1] != tile[0][1]:
+        raise RuntimeError(f'Tiled join changed the crossing count: {exact[0][1]} != {tile[0][1]}')
+    return {'copyQuery': min(t for t, _ in exact), 'copyQuery[grid]': min(t for t, _ in grid), 'copyQuery[tiled]': min(t for t, _ in tile)}
+
+def bench_resampling(size, repeat, replicates=1000):
+    '''Bootstrap intervals for a few boundaries, checking that each interval contains the boundary's own crossing proportions'''
+    import resampling
+    import wisereplication as wr
+
+    column = synthetic.geologic_column(4)
+    tables = synthetic.occurrence_tables(column, size['occs'], size['taxa']//4)
+    occurrences = [(np.array([o[rv.SPECIES] for o in table], dtype=object),
+                    np.array([(float(o[rv.LON]), float(o[rv.LAT])) for o in table])) for table in tables.values()]
+    encoded = {id: resampling.encode_boundary(lower, upper, wr.threshold_distance_deg) for id, (lower, upper) in enumerate(zip(occurrences, occurrences[1:]), 1)}
+
+    results = {}
+    for method in ['bootstrap', 'rarefaction']:
+        results[f'resample_boundaries[{method}]'] = timed(lambda: resampling.resample_boundaries(encoded, replicates, method), repeat)
+    for id, (local_lo, local_hi, global_lo, global_hi) in resampling.resample_boundaries(encoded, replicates, 'bootstrap').items():
+        local, glob = resampling.point_estimate(encoded[id])
+        if not (local_lo <= local <= local_hi and global_lo <= glob <= global_hi):
+            raise RuntimeError(f'Bootstrap interval misses the crossing proportion at boundary {id}: '
+                               f'local {local:.3f} not in ({local_lo:.3f}, {local_hi:.3f}) or global {glob:.3f} not in ({global_lo:.3f}, {global_hi:.3f})')
+    return results
+
+def bench_animation_update(size, repeat):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import sequence_animation as sa
+
+    rng = np.random.default_rng(0)
+    sa.coldata = synthetic.column_locations(size['columns'], rng)
+    sa.animation_data = [list(rng.choice(list(sa.coldata), size['columns']//4, replace=False)) for _ in range(sa.frames)]
+    sa.flow_animation = [list(rng.integers(0, 2, 500)) for _ in range(sa.frames)]
+    sa.m = lambda longs, lats: (np.asarray(longs), np.asarray(lats))
+
+    # Stand-in artists on a plain axes. The benchmark measures the data selection in update, not Basemap projection.
+    plt.figure()
+    sa.column_dots = plt.scatter(*sa.m([c[1] for c in sa.coldata.values()], [c[0] for c in sa.coldata.values()]))
+    sa.flows = plt.quiver(rng.uniform(-160, -60, 500), rng.uniform(25, 70, 500), np.ones(500), np.ones(500))
+    sa.megasequence_text = plt.text(0, 0, '')
+
+    frames = np.linspace(0, sa.frames-1, size['frames']).astype(int)
+    def run():
+        for frame in frames:
+            sa.update(frame)
+    result = {'sequence_animation.update': timed(run, repeat)/len(frames)}
+    plt.close('all')
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(fname):
+    try:
+        with open(fname) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def find_regressions(history, record, threshold):
+    '''Compare each case with the median of earlier runs at the same scale on the same machine'''
+    regressions = []
+    for scale, cases in record['results'].items():
+        for case, seconds in cases.items():
+            previous = [h['results'][scale][case] for h in history
+                        if h['machine'] == record['machine'] and case in h['results'].get(scale, {})]
+            if not previous:
+                continue
+            baseline = statistics.median(previous)
+            if seconds > baseline*(1 + threshold):
+                regressions.append((scale, case, baseline, seconds))
+    return regressions
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark NLSSS processing steps on synthetic data.')
+    parser.add_argument('--scales', nargs='+', choices=list(scales), default=['small'], help='Problem sizes to run. Default small.')
+    parser.add_argument('--cases', nargs='+', choices=['filter', 'boundaries', 'grid', 'resample', 'animation'], default=['filter', 'boundaries', 'grid', 'resample', 'animation'], help='Benchmarks to run. Default all.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions per case. The best time is kept. Default 3.')
+    parser.add_argument('--history', default=history_filename, help='JSON lines file of previous results.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Fractional slowdown relative to history which counts as a regression. Default 0.2.')
+    parser.add_argument('--no-save', action='store_false', dest='save', help='Do not append this run to the history.')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 if any regression is found.')
+    args = parser.parse_args()
+
+    record = dict(timestamp=datetime.now(timezone.utc).isoformat(), commit=git_commit(), python=platform.python_version(),
+                  machine=platform.node() + '/' + platform.machine(), repeat=args.repeat, results={})
+
+    for scale in args.scales:
+        size = scales[scale]
+        results = {}
+        print(f'Running {scale} benchmarks...')
+        if 'filter' in args.cases:
+            results.update(bench_filter_sections(size, args.repeat))
+        if 'boundaries' in args.cases:
+            with tempfile.TemporaryDirectory() as workdir:
+                results.update(bench_boundaries(size, args.repeat, workdir))
+        if 'grid' in args.cases:
+            with tempfile.TemporaryDirectory() as workdir:
+                results.update(bench_grid_preaggregation(size, args.repeat, workdir))
+        if 'resample' in args.cases:
+            results.update(bench_resampling(size, args.repeat))
+        if 'animation' in args.cases:
+            results.update(bench_animation_update(size, args.repeat))
+        record['results'][scale] = results
+        for case, seconds in results.items():
+            print(f'  {case}: {seconds*1000:.3f} ms')
+
+    history = load_history(args.history)
+    regressions = find_regressions(history, record, args.threshold)
+    for scale, case, baseline, seconds in regressions:
+        print(f'Regression: {scale} {case} took {seconds*1000:.3f} ms, median of history is {baseline*1000:.3f} ms')
+
+    if args.save:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        print(f'Results appended to: {args.history}')
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
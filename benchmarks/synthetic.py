@@ -0,0 +1,114 @@
+'''Generators for synthetic geologic columns, occurrence tables and Macrostrat-like section lists.
+Everything is seeded so that benchmark inputs are identical between runs.'''
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paleobiodb_interface import rv
+import sql_statements as sql
+
+def plain_keys(record):
+    '''Records downloaded from PaleoBioDB have str keys. ResponseVocab members cannot be pickled for worker processes.'''
+    return {str(k): v for k, v in record.items()}
+
+def geologic_column(n_intervals, max_age=541.0, rng=None):
+    '''Column of n_intervals contiguous age-level intervals, oldest first (the order produced by wisereplication.queryColumn).
+    Interval widths vary by up to a factor of ~4, like real stages.'''
+    rng = np.random.default_rng(0) if rng is None else rng
+    widths = rng.uniform(1, 4, n_intervals)
+    edges = np.concatenate(([0], np.cumsum(widths)))
+    edges = edges/edges[-1]*max_age
+
+    column = []
+    for i in range(n_intervals):
+        column.append(plain_keys({rv.ID: f'int:{i+1}', rv.NAME: f'Synthetic {i:04d}', rv.LEVEL: 'age', rv.PARENT: 'int:0',
+                       rv.MAX_MA: round(float(edges[n_intervals-i]), 3), rv.MIN_MA: round(float(edges[n_intervals-i-1]), 3)}))
+    return column
+
+def taxon_weights(n_taxa, distribution='zipf', exponent=1.1):
+    '''Relative abundance of each taxon. zipf gives a few very common taxa and a long tail of rare ones.'''
+    if distribution == 'uniform':
+        weights = np.ones(n_taxa)
+    elif distribution == 'zipf':
+        weights = 1/np.arange(1, n_taxa+1)**exponent
+    else:
+        raise ValueError(f'Unknown taxon distribution: {distribution}')
+    return weights/weights.sum()
+
+def occurrence_points(n_occ, n_clusters=50, spread_deg=1.0, rng=None):
+    '''Latitudes and longitudes of n_occ occurrences. Points are drawn around n_clusters localities with zipf-like popularity.
+    n_clusters=0 gives points spread uniformly over the globe. Small spread_deg gives many near-duplicate points.'''
+    rng = np.random.default_rng(0) if rng is None else rng
+    if n_clusters == 0:
+        return rng.uniform(-80, 80, n_occ), rng.uniform(-180, 180, n_occ)
+
+    # Localities are the same for every interval so that taxa can be found on both sides of a boundary at the same place
+    centers = np.random.default_rng(n_clusters)
+    centers_lat = centers.uniform(-60, 70, n_clusters)
+    centers_lon = centers.uniform(-170, 170, n_clusters)
+    popularity = taxon_weights(n_clusters, 'zipf', 1.0)
+    cluster = rng.choice(n_clusters, n_occ, p=popularity)
+    lat = np.clip(centers_lat[cluster] + rng.normal(0, spread_deg, n_occ), -90, 90)
+    lon = np.clip(centers_lon[cluster] + rng.normal(0, spread_deg, n_occ), -180, 180)
+    return lat, lon
+
+def occurrences(n_occ, n_taxa, taxon_offset=0, taxon_distribution='zipf', n_clusters=50, spread_deg=1.0, id_offset=0, rng=None):
+    '''List of occurrence records in the PaleoBioDB compact vocabulary. Taxon names are drawn from
+    taxon_offset..taxon_offset+n_taxa so that neighbouring intervals can share part of their fauna.'''
+    rng = np.random.default_rng(0) if rng is None else rng
+    taxa = taxon_offset + rng.choice(n_taxa, n_occ, p=taxon_weights(n_taxa, taxon_distribution))
+    lat, lon = occurrence_points(n_occ, n_clusters, spread_deg, rng)
+
+    return [plain_keys({rv.ID: f'occ:{id_offset+i}', rv.LAT: f'{lat[i]:.4f}', rv.LON: f'{lon[i]:.4f}', rv.PRECISION: 'seconds',
+             rv.SPECIES: f'Genus{t//10} species{t}', rv.GENUS: f'Genus{t//10}', rv.FAMILY: f'Family{t//100}'})
+            for i, t in enumerate(taxa)]
+
+def occurrence_tables(column, occs_per_interval, n_taxa, turnover=0.3, occ_sigma=0.0, **kwargs):
+    '''Occurrence records for every interval in column, keyed by interval name. A fraction turnover of the taxon pool is replaced
+    at each boundary. occ_sigma > 0 draws the number of occurrences per interval from a lognormal around occs_per_interval.'''
+    rng = np.random.default_rng(kwargs.pop('seed', 0))
+    tables = {}
+    id_offset = 0
+    for i, interval in enumerate(column):
+        n_occ = occs_per_interval if occ_sigma == 0 else max(1, int(rng.lognormal(np.log(occs_per_interval), occ_sigma)))
+        tables[interval[rv.NAME]] = occurrences(n_occ, n_taxa, int(i*turnover*n_taxa), id_offset=id_offset, rng=rng, **kwargs)
+        id_offset += n_occ
+    return tables
+
+def occurrence_database(fname, column, tables):
+    '''Write occurrence tables to a SpatiaLite database using the same schema as wisereplication.retreive_paleobiodb_data'''
+    import spatialite as sqlite3
+    from wisereplication import tableName
+
+    def get_insert_values(occurrence):
+        return (occurrence[rv.ID], float(occurrence[rv.LAT]), float(occurrence[rv.LON]), occurrence[rv.PRECISION],
+                occurrence[rv.SPECIES], occurrence[rv.GENUS], occurrence[rv.FAMILY])
+
+    with sqlite3.connect(fname) as conn:
+        cursor = conn.cursor()
+        for interval in column:
+            tablename = tableName(interval[rv.NAME])
+            cursor.execute(sql.dropTableQuery.format(tablename))
+            cursor.execute(sql.create_table_query.format(tablename))
+            cursor.executemany(sql.insert_query.format(tablename), (get_insert_values(occ) for occ in tables[interval[rv.NAME]]))
+        conn.commit()
+
+def macrostrat_sections(n_sections, max_age=540.0, n_columns=500, rng=None):
+    '''Section records resembling the Macrostrat sections endpoint. Durations are lognormal so that most packages are short
+    and a few span tens of Myr. About 5% have zero thickness.'''
+    rng = np.random.default_rng(0) if rng is None else rng
+    t_age = rng.uniform(0, max_age, n_sections)
+    b_age = np.minimum(t_age + rng.lognormal(1.5, 1.0, n_sections), max_age + 50)
+    thick = np.where(rng.random(n_sections) < 0.05, 0, rng.lognormal(4, 1, n_sections))
+    col_id = rng.integers(1, n_columns+1, n_sections)
+    return [dict(col_id=int(col_id[i]), t_age=round(float(t_age[i]), 3), b_age=round(float(b_age[i]), 3), max_thick=f'{thick[i]:.2f}')
+            for i in range(n_sections)]
+
+def column_locations(n_columns, rng=None):
+    '''Macrostrat column locations in the form cached by sequence_animation: {col_id: (lat, lng)}'''
+    rng = np.random.default_rng(0) if rng is None else rng
+    lat = rng.uniform(25, 70, n_columns)
+    lng = rng.uniform(-160, -60, n_columns)
+    return {i+1: (float(lat[i]), float(lng[i])) for i in range(n_columns)}
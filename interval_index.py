@@ -0,0 +1,49 @@
+import numpy as np
+
+class AgeIndex:
+    '''Finds records whose age range [min_ma, max_ma] falls in a time interval, using binary search on the sorted oldest ages.
+    Records are identified by the ids passed in (e.g. SQLite rowids).
+
+    Rules follow the PaleoBioDB timerule parameter:
+        contain: the whole age range lies within the interval
+        major: more than half of the age range lies within the interval (records with no range use contain)
+        overlap: any part of the age range lies within the interval
+    Records with no age range (max_ma == min_ma) are treated as half-open under every rule, top <= age < base, so that a record dated exactly
+    at a boundary is assigned to the younger interval only.'''
+
+    def __init__(self, ids, max_ma, min_ma):
+        order = np.argsort(max_ma, kind='stable')
+        self.ids = np.asarray(ids)[order]
+        self.max_ma = np.asarray(max_ma, dtype=float)[order]
+        self.min_ma = np.asarray(min_ma, dtype=float)[order]
+        # No record older than max_ma can reach back further than this, which bounds the search for overlapping records
+        self.max_span = float(np.max(self.max_ma - self.min_ma)) if len(self.max_ma) else 0.0
+
+    def _candidates(self, lo, hi, right_closed):
+        '''Slice of records whose max_ma lies in [lo, hi] (or [lo, hi) if not right_closed)'''
+        start = np.searchsorted(self.max_ma, lo, side='left')
+        stop = np.searchsorted(self.max_ma, hi, side='right' if right_closed else 'left')
+        return slice(start, stop)
+
+    def select(self, top, base, rule='major'):
+        '''ids of records assigned to the interval from top (young, Ma) to base (old, Ma) under rule'''
+        if rule == 'contain':
+            # max_ma >= min_ma >= top, so max_ma must lie in [top, base]
+            window = self._candidates(top, base, True)
+        elif rule in ('overlap', 'major'):
+            window = self._candidates(top, base + self.max_span, True)
+        else:
+            raise ValueError(f'Unknown age assignment rule: {rule}')
+
+        old = self.max_ma[window]
+        young = self.min_ma[window]
+        span = old - young
+        point = (young >= top) & (old < base)
+        if rule == 'contain':
+            mask = np.where(span > 0, young >= top, point)
+        elif rule == 'overlap':
+            mask = np.where(span > 0, (old > top) & (young < base), point)
+        else:
+            inside = np.minimum(old, base) - np.maximum(young, top)
+            mask = np.where(span > 0, inside > span/2, point)
+        return self.ids[window][mask]
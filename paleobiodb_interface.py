@@ -14,9 +14,16 @@ interval_request = 'intervals/list.json?scale=1'
 column_parent_fragment = '&min_ma={}&max_ma={}'
 
 occurrence_request = ''
+bulk_occurrence_request = ''
 
 def init_paleobiodb_queries(taxon_level, env_type=None, taxa_filt=None):
-    global occurrence_request
-    occurrence_request = ('occs/list.json?interval_id={}&pres=regular&show=acconly,class,coords,loc&idreso=' + taxon_level + 
+    filters = ('&pres=regular&show=acconly,class,coords,loc&idreso=' + taxon_level + 
             ('&' + rv.ENVIRONMENT + '=' + env_type if env_type is not None else '') + 
             ('&' + rv.FILTER_TAXA + '=' + taxa_filt if taxa_filt is not None else ''))
+
+    global occurrence_request
+    occurrence_request = 'occs/list.json?interval_id={}' + filters
+
+    # Every occurrence whose age range touches min_ma..max_ma. Records include their own age range (eag, lag) for local interval assignment.
+    global bulk_occurrence_request
+    bulk_occurrence_request = 'occs/list.json?min_ma={}&max_ma={}&timerule=overlap' + filters
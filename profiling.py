@@ -0,0 +1,128 @@
+import csv
+import json
+import time
+import sqlite3
+import requests
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Number of SQLite virtual machine instructions between progress handler callbacks. Smaller values give finer counts at some cost in speed.
+progress_granularity = 1000
+
+class Trace:
+    '''Records wall time, work done and query plans for pipeline statements and downloads.
+    When disabled every method falls straight through to the underlying call, so it can be left in place for normal runs.
+    records may be any list-like object, e.g. a multiprocess Manager list shared with worker processes.'''
+
+    def __init__(self, enabled=True, records=None):
+        self.enabled = enabled
+        self.records = [] if records is None else records
+
+    def execute(self, cursor, statement, stage, boundary=None, plan=True):
+        '''Execute a single SQL statement and record it. vm_steps is the number of SQLite VM instructions run (to within progress_granularity),
+        which is the closest available proxy for rows scanned since sqlite3 does not expose per-statement scan counters.'''
+        if not self.enabled:
+            return cursor.execute(statement)
+
+        conn = cursor.connection
+        query_plan = None
+        if plan:
+            try:
+                query_plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement).fetchall()]
+            except sqlite3.Error:
+                pass
+
+        steps = [0]
+        def count_steps():
+            steps[0] += 1
+            return 0
+
+        conn.set_progress_handler(count_steps, progress_granularity)
+        start = time.perf_counter()
+        try:
+            cursor.execute(statement)
+        finally:
+            elapsed = time.perf_counter() - start
+            conn.set_progress_handler(None, 0)
+
+        self.records.append(dict(kind='sql', stage=stage, boundary=boundary, wall_s=elapsed, vm_steps=steps[0]*progress_granularity,
+                                 statement=statement, query_plan=query_plan))
+        return cursor
+
+    def executescript(self, cursor, script, stage, boundary=None):
+        '''Execute a multi-statement script (e.g. view creation). Plans are not recorded for scripts.'''
+        if not self.enabled:
+            return cursor.executescript(script)
+
+        start = time.perf_counter()
+        cursor.executescript(script)
+        self.records.append(dict(kind='sql', stage=stage, boundary=boundary, wall_s=time.perf_counter() - start, statement=script))
+        return cursor
+
+    @contextmanager
+    def span(self, stage, boundary=None, statement=None):
+        '''Record the wall time of a block of database work that is not a single statement on one connection, e.g. work spread across processes'''
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append(dict(kind='sql', stage=stage, boundary=boundary, wall_s=time.perf_counter() - start, statement=statement))
+
+    def request(self, url, stage, interval=None):
+        '''GET a URL with requests, recording total time, server latency (time to response headers) and body size'''
+        if not self.enabled:
+            return requests.get(url)
+
+        start = time.perf_counter()
+        res = requests.get(url)
+        elapsed = time.perf_counter() - start
+        self.records.append(dict(kind='http', stage=stage, boundary=interval, wall_s=elapsed, latency_s=res.elapsed.total_seconds(),
+                                 bytes=len(res.content), status=res.status_code, statement=url))
+        return res
+
+    def write(self, basename):
+        '''Write all records to basename_trace.json and basename_trace.csv. Returns the file names written.'''
+        records = [dict(r) for r in self.records]
+        json_name = basename + '_trace.json'
+        csv_name = basename + '_trace.csv'
+
+        with open(json_name, 'w') as f:
+            json.dump(records, f, indent=1)
+
+        fieldnames = []
+        for record in records:
+            fieldnames.extend(k for k in record if k not in fieldnames)
+        with open(csv_name, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for record in records:
+                if record.get('query_plan') is not None:
+                    record['query_plan'] = ' | '.join(record['query_plan'])
+                writer.writerow(record)
+        return json_name, csv_name
+
+    def summary(self, n=10):
+        '''Print the n boundaries with the largest total wall time, broken down by stage, then the n slowest downloaded intervals'''
+        self._print_slowest([r for r in self.records if r['kind'] == 'sql'], n, 'traced boundaries')
+        downloads = [r for r in self.records if r['kind'] == 'http']
+        if downloads:
+            self._print_slowest(downloads, n, 'downloaded intervals')
+
+    @staticmethod
+    def _print_slowest(records, n, label):
+        totals = defaultdict(float)
+        stages = defaultdict(lambda: defaultdict(float))
+        for record in records:
+            if record['boundary'] is None:
+                continue
+            totals[record['boundary']] += record['wall_s']
+            stages[record['boundary']][record['stage']] += record['wall_s']
+
+        print(f'Slowest {min(n, len(totals))} of {len(totals)} {label}:')
+        for boundary in sorted(totals, key=totals.get, reverse=True)[:n]:
+            breakdown = ', '.join(f'{stage}: {t:.2f}s' for stage, t in sorted(stages[boundary].items(), key=lambda kv: kv[1], reverse=True))
+            print(f'  {boundary}: {totals[boundary]:.2f}s ({breakdown})')
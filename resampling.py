@@ -0,0 +1,136 @@
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+from multiprocess import Pool
+
+# Offset between taxa on the third KD-tree axis. Larger than any distance in degrees, so occurrences of different taxa are never paired.
+taxon_separation = 1.0e4
+
+# Upper bound on the number of array elements in one batch of replicates. Keeps memory use flat for any replicate count.
+batch_elements = 2**25
+
+def load_occurrences(conn, table, taxon_field):
+    '''Taxon names and coordinates of every occurrence in table. Occurrences without a taxon name are dropped, as they are by countQuery.'''
+    rows = conn.execute(f'SELECT {taxon_field}, ST_X(location), ST_Y(location) FROM {table} WHERE {taxon_field} IS NOT NULL').fetchall()
+    taxa = np.array([r[0] for r in rows], dtype=object)
+    xy = np.array([(r[1], r[2]) for r in rows], dtype=float).reshape(-1, 2)
+    return taxa, xy
+
+def encode_boundary(lower, upper, threshold_distance_deg):
+    '''Integer-code the occurrences on both sides of a boundary.
+    Duplicate (taxon, location) occurrences are merged into one point with a multiplicity, since they are interchangeable under resampling.
+    Returns a dict of arrays:
+        lower_taxon, upper_taxon: taxon code of each distinct point
+        lower_count, upper_count: number of occurrences at each distinct point
+        pair_lower, pair_upper: indices of distinct lower/upper points of the same taxon within the threshold distance'''
+    lower_taxa, lower_xy = lower
+    upper_taxa, upper_xy = upper
+    names, codes = np.unique(np.concatenate((lower_taxa, upper_taxa)).astype(str), return_inverse=True)
+    codes = codes.reshape(-1)
+
+    def distinct_points(taxon_codes, xy):
+        keys = np.column_stack((xy, taxon_codes*taxon_separation))
+        points, counts = np.unique(keys, axis=0, return_counts=True)
+        return points, counts
+
+    lower_points, lower_count = distinct_points(codes[:len(lower_taxa)], lower_xy)
+    upper_points, upper_count = distinct_points(codes[len(lower_taxa):], upper_xy)
+
+    pair_lower = pair_upper = np.zeros(0, dtype=np.int64)
+    if len(lower_points) and len(upper_points):
+        pairs = cKDTree(lower_points).sparse_distance_matrix(cKDTree(upper_points), threshold_distance_deg, output_type='ndarray')
+        pair_lower = pairs['i'].astype(np.int64)
+        pair_upper = pairs['j'].astype(np.int64)
+
+    return dict(n_taxa=len(names),
+                lower_taxon=np.rint(lower_points[:, 2]/taxon_separation).astype(np.int64), lower_count=lower_count,
+                upper_taxon=np.rint(upper_points[:, 2]/taxon_separation).astype(np.int64), upper_count=upper_count,
+                pair_lower=pair_lower, pair_upper=pair_upper)
+
+def _incidence(rows, n_taxa):
+    '''Sparse matrix mapping each point (or pair) to its taxon'''
+    return sparse.csr_matrix((np.ones(len(rows)), (np.arange(len(rows)), rows)), shape=(len(rows), n_taxa))
+
+def _draw(rng, counts, replicates, method, sample_size):
+    '''Number of times each distinct point is drawn in each replicate, shape (replicates, points)'''
+    if len(counts) == 0:
+        return np.zeros((replicates, 0), dtype=np.int64)
+    if method == 'bootstrap':
+        return rng.multinomial(counts.sum(), counts/counts.sum(), size=replicates)
+    if method == 'rarefaction':
+        return rng.multivariate_hypergeometric(counts, min(sample_size, counts.sum()), size=replicates)
+    raise ValueError(f'Unknown resampling method: {method}')
+
+def _proportions(encoded, lower_present, upper_present):
+    '''Local and global crossing proportions for each row of the point presence matrices lower_present and upper_present'''
+    n_taxa = encoded['n_taxa']
+    lower_taxa = _incidence(encoded['lower_taxon'], n_taxa)
+    upper_taxa = _incidence(encoded['upper_taxon'], n_taxa)
+    pair_taxa = _incidence(encoded['lower_taxon'][encoded['pair_lower']], n_taxa)
+
+    lower_taxon_present = (lower_taxa.T @ lower_present.T).T > 0
+    upper_taxon_present = (upper_taxa.T @ upper_present.T).T > 0
+    pair_present = lower_present[:, encoded['pair_lower']] & upper_present[:, encoded['pair_upper']]
+    local_taxon = (pair_taxa.T @ pair_present.T).T > 0
+
+    denom = np.count_nonzero(lower_taxon_present | upper_taxon_present, axis=1)
+    safe = np.maximum(denom, 1)
+    local = np.where(denom == 0, 0, np.count_nonzero(local_taxon, axis=1)/safe)
+    glob = np.where(denom == 0, 0, np.count_nonzero(lower_taxon_present & upper_taxon_present, axis=1)/safe)
+    return local, glob
+
+def point_estimate(encoded):
+    '''Local and global crossing proportions of every occurrence, equal to the _pct results of overlap_statistics'''
+    local, glob = _proportions(encoded, np.ones((1, len(encoded['lower_count'])), dtype=bool), np.ones((1, len(encoded['upper_count'])), dtype=bool))
+    return float(local[0]), float(glob[0])
+
+def resample_boundary(encoded, replicates, method='bootstrap', sample_size=None, seed=None):
+    '''Local and global crossing proportions for each replicate, with the same definitions as overlap_statistics:
+    crossing taxa in the lower interval divided by distinct taxa on either side of the boundary.
+    bootstrap resamples each interval's occurrences with replacement. rarefaction draws sample_size occurrences without replacement
+    from each interval (default: the size of the smaller interval), so boundaries with different sampling intensity can be compared.'''
+    rng = np.random.default_rng(seed)
+    if sample_size is None:
+        sample_size = min(encoded['lower_count'].sum(), encoded['upper_count'].sum())
+
+    n_taxa = encoded['n_taxa']
+    width = max(len(encoded['lower_count']), len(encoded['upper_count']), len(encoded['pair_lower']), n_taxa, 1)
+    batch = max(1, batch_elements//width)
+
+    local = np.zeros(replicates)
+    glob = np.zeros(replicates)
+    for start in range(0, replicates, batch):
+        n = min(batch, replicates - start)
+        lower_present = _draw(rng, encoded['lower_count'], n, method, sample_size) > 0
+        upper_present = _draw(rng, encoded['upper_count'], n, method, sample_size) > 0
+        local[start:start+n], glob[start:start+n] = _proportions(encoded, lower_present, upper_present)
+    return local, glob
+
+def confidence_interval(replicates, estimate, confidence, method='bootstrap'):
+    '''Confidence interval (lo, hi) from the replicates of resample_boundary.
+    A bootstrap sample holds only about 63% of the distinct occurrences, so taxon presence and especially local crossings are
+    undercounted in every replicate. The percentile interval is therefore shifted by the bootstrap estimate of that bias
+    (estimate minus the replicate mean), which centres it on estimate.
+    rarefaction intervals are left as percentiles: they describe the proportion at the rarefied sample size, not estimate.'''
+    quantiles = np.quantile(replicates, [(1 - confidence)/2, (1 + confidence)/2])
+    if method == 'bootstrap':
+        quantiles = np.clip(quantiles + estimate - np.mean(replicates), 0, 1)
+    return tuple(float(q) for q in quantiles)
+
+def _resample_task(task):
+    id, encoded, replicates, method, sample_size, seed = task
+    return id, resample_boundary(encoded, replicates, method, sample_size, seed)
+
+def resample_boundaries(encoded_boundaries, replicates, method='bootstrap', confidence=0.95, sample_size=None, seed=0, processes=None):
+    '''Resample every boundary in encoded_boundaries ({id: encode_boundary output}) across a process pool.
+    Returns {id: (local_lo, local_hi, global_lo, global_hi)} confidence intervals from confidence_interval.'''
+    seeds = np.random.SeedSequence(seed).spawn(len(encoded_boundaries))
+    tasks = [(id, encoded, replicates, method, sample_size, s) for (id, encoded), s in zip(encoded_boundaries.items(), seeds)]
+
+    intervals = {}
+    with Pool(processes) as pool:
+        for id, (local, glob) in pool.imap_unordered(_resample_task, tasks):
+            local_estimate, global_estimate = point_estimate(encoded_boundaries[id])
+            intervals[id] = (confidence_interval(local, local_estimate, confidence, method) +
+                             confidence_interval(glob, global_estimate, confidence, method))
+    return intervals
@@ -0,0 +1,131 @@
+import os
+import csv
+import json
+import sqlite3
+import hashlib
+from datetime import datetime, timezone
+import numpy as np
+
+# One row per run: the settings it was made with and the order of its result fields
+create_runs_query = 'CREATE TABLE IF NOT EXISTS runs(fingerprint TEXT PRIMARY KEY, settings TEXT, fields TEXT, created TEXT)'
+# Boundary names and ages (Ma) of each run, so that runs over different columns can be aligned and ordered by boundary
+create_boundaries_query = 'CREATE TABLE IF NOT EXISTS boundaries(fingerprint TEXT, bdry_no INTEGER, boundary TEXT, age REAL, PRIMARY KEY(fingerprint, bdry_no)) WITHOUT ROWID'
+# Results in long format: one row per run, boundary and field. value has no declared type so that counts stay integers
+create_values_query = 'CREATE TABLE IF NOT EXISTS result_values(fingerprint TEXT, bdry_no INTEGER, field TEXT, value, PRIMARY KEY(fingerprint, field, bdry_no)) WITHOUT ROWID'
+
+insert_run_query = 'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)'
+insert_boundary_query = 'INSERT INTO boundaries VALUES (?, ?, ?, ?)'
+insert_value_query = 'INSERT INTO result_values VALUES (?, ?, ?, ?)'
+delete_run_queries = ['DELETE FROM boundaries WHERE fingerprint = ?', 'DELETE FROM result_values WHERE fingerprint = ?']
+
+def fingerprint(settings):
+    '''Short hash identifying a dict of settings'''
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def connect(store_filename):
+    conn = sqlite3.connect(store_filename)
+    for query in (create_runs_query, create_boundaries_query, create_values_query):
+        conn.execute(query)
+    # Stores made before boundary ages were recorded
+    if 'age' not in [row[1] for row in conn.execute('PRAGMA table_info(boundaries)')]:
+        conn.execute('ALTER TABLE boundaries ADD COLUMN age REAL')
+    return conn
+
+def append_run(store_filename, settings, data, ages=None):
+    '''Save the results of one run ({bdry_no: {boundary:, field: value, ...}}, as passed to export_dict_of_dicts_to_csv) under the fingerprint of settings.
+    ages ({bdry_no: Ma}) orders boundaries across runs in load_runs. A run with the same settings replaces the earlier one. Returns the fingerprint.'''
+    ages = ages or {}
+    key = fingerprint(settings)
+    fields = [field for field in data[next(iter(data))].keys() if field != 'boundary']
+    with connect(store_filename) as conn:
+        for query in delete_run_queries:
+            conn.execute(query, (key,))
+        conn.execute(insert_run_query, (key, json.dumps(settings, sort_keys=True), json.dumps(fields), datetime.now(timezone.utc).isoformat()))
+        conn.executemany(insert_boundary_query, ((key, id, res['boundary'], ages.get(id)) for id, res in data.items()))
+        conn.executemany(insert_value_query, ((key, id, field, res.get(field)) for id, res in data.items() for field in fields))
+    conn.close()
+    return key
+
+def list_runs(store_filename, **criteria):
+    '''Runs in the store as a list of dicts (fingerprint, created, fields and each setting), oldest first.
+    Keyword arguments keep only runs whose settings have those values, e.g. list_runs(fname, taxon_level='genus').'''
+    with connect(store_filename) as conn:
+        rows = conn.execute('SELECT fingerprint, settings, fields, created FROM runs ORDER BY created').fetchall()
+    conn.close()
+    runs = []
+    for key, settings, fields, created in rows:
+        settings = json.loads(settings)
+        if all(settings.get(name) == value for name, value in criteria.items()):
+            runs.append(dict(settings, fingerprint=key, created=created, fields=json.loads(fields)))
+    return runs
+
+def load_runs(store_filename, fingerprints, fields=None):
+    '''Results of several runs aligned by boundary, read from the store in one call.
+    Returns (boundaries, values): boundaries is an array of the boundary names found in any of the runs, oldest first
+    (boundaries saved without an age follow, in the order of the first listed run that has them), and values maps each field to a float array of shape (len(fingerprints), len(boundaries)). Boundaries or fields missing from a run are NaN.'''
+    fingerprints = list(fingerprints)
+    marks = ', '.join('?'*len(fingerprints))
+    with connect(store_filename) as conn:
+        boundary_rows = conn.execute(f'SELECT fingerprint, bdry_no, boundary, age FROM boundaries WHERE fingerprint IN ({marks})', fingerprints).fetchall()
+        query = f'SELECT fingerprint, bdry_no, field, value FROM result_values WHERE fingerprint IN ({marks})'
+        if fields is not None:
+            query += f' AND field IN ({", ".join("?"*len(fields))})'
+        value_rows = conn.execute(query, fingerprints + list(fields or [])).fetchall()
+    conn.close()
+
+    run_index = {key: i for i, key in enumerate(fingerprints)}
+    order = {}
+    for key, id, boundary, age in boundary_rows:
+        sort_key = (age is None, -(age or 0), run_index[key], id)
+        order[boundary] = min(order.get(boundary, sort_key), sort_key)
+    names = sorted(order, key=order.get)
+    column = {name: i for i, name in enumerate(names)}
+    position = {(key, id): column[boundary] for key, id, boundary, _ in boundary_rows}
+
+    if fields is None:
+        fields = list(dict.fromkeys(field for _, _, field, _ in value_rows))
+    values = {field: np.full((len(fingerprints), len(names)), np.nan) for field in fields}
+    for key, id, field, value in value_rows:
+        if value is not None:
+            values[field][run_index[key], position[(key, id)]] = value
+    return np.array(names, dtype=object), values
+
+def export_runs(store_filename, fingerprints, directory, stem='nlsss'):
+    '''Write one CSV per run, with the same columns as export_dict_of_dicts_to_csv, named <stem>_<fingerprint>.csv in directory.
+    Reads only the result store. Returns the file names.'''
+    runs = {run['fingerprint']: run for run in list_runs(store_filename)}
+    fnames = []
+    with connect(store_filename) as conn:
+        for key in fingerprints:
+            fields = runs[key]['fields']
+            rows = {id: {'bdry_no': id, 'boundary': boundary} for id, boundary in
+                    conn.execute('SELECT bdry_no, boundary FROM boundaries WHERE fingerprint = ? ORDER BY bdry_no', (key,))}
+            for id, field, value in conn.execute('SELECT bdry_no, field, value FROM result_values WHERE fingerprint = ?', (key,)):
+                rows[id][field] = value
+
+            fname = os.path.join(directory, f'{stem}_{key}.csv')
+            with open(fname, 'w', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=['bdry_no', 'boundary'] + fields)
+                writer.writeheader()
+                writer.writerows(rows.values())
+            fnames.append(fname)
+    conn.close()
+    return fnames
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List and export NLSSS runs saved in a result store.')
+    parser.add_argument('store', help='Result store file (result_store_filename in wisereplication.py).')
+    parser.add_argument('--export', nargs='*', metavar='FINGERPRINT', help='Write a CSV for each listed run, or every run if none are listed.')
+    parser.add_argument('--out', default='.', help='Directory for exported CSVs. Default current directory.')
+    args = parser.parse_args()
+
+    runs = list_runs(args.store)
+    if args.export is None:
+        for run in runs:
+            settings = ', '.join(f'{name}={value}' for name, value in run.items() if name not in ('fingerprint', 'created', 'fields'))
+            print(f'{run["fingerprint"]}  {run["created"]}  {settings}')
+    else:
+        for fname in export_runs(args.store, args.export or [run['fingerprint'] for run in runs], args.out):
+            print(f'Results written to: {fname}')
@@ -35,96 +35,12 @@ show_plot = True
 max_age = 540 # Ma
 step = max_age/frames # Ma
 
+# Custom colormap for paleoflow directions
+cmap = mpl.colormaps['Set2']
+# Normalization: values from 0 to 2pi
+norm = Normalize(vmin=0, vmax=2*np.pi)
 
-print('Getting column location information...')
-try:
-    with open(fname, 'rb') as f:
-        coldata = pickle.load(f)
-
-except Exception as e:
-    res = req.get(stagesQuery)
-    data = res.json()['success']['data']
-
-    coldata = {}
-    for col in data:
-        coldata[col['col_id']] = (float(col['lat']), float(col['lng']))
-    with open(fname, 'wb') as f:
-        pickle.dump(coldata, f)
-
-print('Getting Macrostrat gap bound package data...')
-
-try:
-    with open(animation_fname, 'rb') as f:
-        animation_data = pickle.load(f)
-
-except:
-    x = np.arange(0, max_age, step)
-    animation_data = []
-    for i, interval in enumerate(tqdm(x)):
-        res = req.get(baseUrl+f'sections?age_top={interval}&age_bottom={interval+step}')
-        column_ids = [x['col_id'] for x in res.json()['success']['data']]
-        animation_data.append(column_ids)
-    
-    animation_data = animation_data[::-1] # Reverse to go in time order
-    with open(animation_fname, 'wb') as f:
-        pickle.dump(animation_data, f)
-
-print('Getting Brand and Chadwick (2015) paleocurrent data...')
-
-try:
-    with open(paleoflow_fname, 'rb') as f:
-        paleoflowData = pickle.load(f)
-
-except:
-    res = req.get(paleoflowQuery)
-    flow_data = res.json()['success']['data']
-    paleoflowData = [ dict(azimuth=x['measure_value'][0], lat=x['lat'], lon=x['lng'], err=x['measure_error'][0], unit_id=x['unit_id']) for x in flow_data]
-
-    print('Enriching paleocurrent data with dates...')
-    units_to_query = set()
-    for dict in paleoflowData:
-        units_to_query.add(dict['unit_id'])
-
-    list_to_query = list(units_to_query)
-    list_to_query.sort() # Sort by unit_id
-    ages = []
-
-    for unit in tqdm(list_to_query):
-        res = req.get(baseUrl+f'units?unit_id={unit}')
-        unit_data = res.json()['success']['data'][0]
-        ages.append((unit_data['t_age'] + unit_data['b_age'])/2)
-
-    paleoflowData.sort(key=operator.itemgetter('unit_id')) # Sort by unit_id for optimal matching
-
-    flowPointer = 0
-    for unit, age in zip(list_to_query, ages):
-        while flowPointer < len(paleoflowData) and paleoflowData[flowPointer]['unit_id'] == unit:
-            paleoflowData[flowPointer]['age'] = age
-            flowPointer += 1
-
-    paleoflowData.sort(key=operator.itemgetter('age')) # Sort by age for animating
-
-    with open(paleoflow_fname, 'wb') as f:
-        pickle.dump(paleoflowData, f)
-    pass
-
-print('Age binning paleoflows...')
-
-try:
-    with open(flow_animation_fname, 'rb') as f:
-        flow_animation = pickle.load(f)
-
-except:
-    x = np.arange(0, max_age, step)
-    flow_animation = []
-    for i, interval in enumerate(x):
-        flow_list = [1 if d['age'] > interval and d['age'] <= interval+step else 0 for d in paleoflowData]
-        flow_animation.append(flow_list)
-    
-    with open(flow_animation_fname, 'wb') as f:
-        pickle.dump(flow_animation, f)
-
-flow_animation = flow_animation[::-1] # Reverse to go in time order
+viridis = mpl.colormaps['viridis']
 
 
 def extract_coords(dict):
@@ -152,59 +68,6 @@ def extract_uv(list):
         vs.append(np.sin(az))
     return us, vs
 
-print('Plotting data...')
-lats, longs = extract_coords(coldata)
-
-plt.figure(figsize=(10.5,12))
-
-# setup lambert conformal basemap.
-# lat_1 is first standard parallel.
-# lat_2 is second standard parallel (defaults to lat_1).
-# lon_0,lat_0 is central point.
-# rsphere=(6378137.00,6356752.3142) specifies WGS84 ellipsoid
-# area_thresh=1000 means don't plot coastline features less
-# than 1000 km^2 in area.
-m = Basemap(width=7000000,height=8000000,
-            rsphere=(6378137.00,6356752.3142),\
-            resolution='l',area_thresh=3000.,projection='lcc',\
-            lat_1=35.,lat_2=55,lat_0=50,lon_0=-103.)
-m.drawcoastlines()
-m.drawcountries()
-m.drawstates()
-m.fillcontinents(color='ivory',lake_color='aqua')
-# draw parallels and meridians.
-m.drawparallels(np.arange(-80.,81.,10.))
-m.drawmeridians(np.arange(-180.,181.,10.))
-m.drawmapboundary(fill_color='aqua') 
-
-if plot_columns:
-    x, y = m(longs, lats)
-    column_dots = m.scatter(x,y,50,marker='o',color='k', label='Gap bound packages')
-
-# Custom colormap for paleoflow directions
-cmap = mpl.colormaps['Set2']
-# Normalization: values from 0 to 2pi
-norm = Normalize(vmin=0, vmax=2*np.pi)
-
-if plot_paleoflows:
-    arrow_lat, arrow_lon = extract_arrows(paleoflowData)
-    us, vs = extract_uv(paleoflowData)
-    arr_x, arr_y = m(arrow_lon, arrow_lat)
-
-    flows = plt.quiver(arr_x, arr_y, us, vs, np.arctan2(us, vs)+np.pi, cmap=cmap, norm=norm, pivot='tail', angles='xy', scale=25, label='Paleocurrents')
-
-    # these are matplotlib.patch.Patch properties
-    props = dict(boxstyle='round', facecolor='black')
-
-    # place a text box in upper left in axes coords
-    megasequence_text = plt.text(0.04, 0.17, "Macrostratigraphy", transform=plt.gca().transAxes, color='white', fontsize=28,
-            verticalalignment='top', fontweight='bold', bbox=props)
-
-
-plt.title(f"North American Macrostratigraphy By Time ({step} Ma bins)")
-
-viridis = mpl.colormaps['viridis']
-
 def update(frame):
     res = []
     if plot_columns:
@@ -258,18 +121,156 @@ class HandlerImage(HandlerPolyCollection):
         handlebox.add_artist(img)
         return img
 
-plt.legend(loc='best', fontsize=16, framealpha=1, handler_map={PolyCollection: HandlerImage()})
+if __name__ == '__main__':
+    print('Getting column location information...')
+    try:
+        with open(fname, 'rb') as f:
+            coldata = pickle.load(f)
+
+    except Exception as e:
+        res = req.get(stagesQuery)
+        data = res.json()['success']['data']
+
+        coldata = {}
+        for col in data:
+            coldata[col['col_id']] = (float(col['lat']), float(col['lng']))
+        with open(fname, 'wb') as f:
+            pickle.dump(coldata, f)
+
+    print('Getting Macrostrat gap bound package data...')
+
+    try:
+        with open(animation_fname, 'rb') as f:
+            animation_data = pickle.load(f)
+
+    except:
+        x = np.arange(0, max_age, step)
+        animation_data = []
+        for i, interval in enumerate(tqdm(x)):
+            res = req.get(baseUrl+f'sections?age_top={interval}&age_bottom={interval+step}')
+            column_ids = [x['col_id'] for x in res.json()['success']['data']]
+            animation_data.append(column_ids)
+    
+        animation_data = animation_data[::-1] # Reverse to go in time order
+        with open(animation_fname, 'wb') as f:
+            pickle.dump(animation_data, f)
+
+    print('Getting Brand and Chadwick (2015) paleocurrent data...')
+
+    try:
+        with open(paleoflow_fname, 'rb') as f:
+            paleoflowData = pickle.load(f)
+
+    except:
+        res = req.get(paleoflowQuery)
+        flow_data = res.json()['success']['data']
+        paleoflowData = [ dict(azimuth=x['measure_value'][0], lat=x['lat'], lon=x['lng'], err=x['measure_error'][0], unit_id=x['unit_id']) for x in flow_data]
+
+        print('Enriching paleocurrent data with dates...')
+        units_to_query = set()
+        for dict in paleoflowData:
+            units_to_query.add(dict['unit_id'])
+
+        list_to_query = list(units_to_query)
+        list_to_query.sort() # Sort by unit_id
+        ages = []
+
+        for unit in tqdm(list_to_query):
+            res = req.get(baseUrl+f'units?unit_id={unit}')
+            unit_data = res.json()['success']['data'][0]
+            ages.append((unit_data['t_age'] + unit_data['b_age'])/2)
+
+        paleoflowData.sort(key=operator.itemgetter('unit_id')) # Sort by unit_id for optimal matching
+
+        flowPointer = 0
+        for unit, age in zip(list_to_query, ages):
+            while flowPointer < len(paleoflowData) and paleoflowData[flowPointer]['unit_id'] == unit:
+                paleoflowData[flowPointer]['age'] = age
+                flowPointer += 1
+
+        paleoflowData.sort(key=operator.itemgetter('age')) # Sort by age for animating
+
+        with open(paleoflow_fname, 'wb') as f:
+            pickle.dump(paleoflowData, f)
+        pass
+
+    print('Age binning paleoflows...')
+
+    try:
+        with open(flow_animation_fname, 'rb') as f:
+            flow_animation = pickle.load(f)
+
+    except:
+        x = np.arange(0, max_age, step)
+        flow_animation = []
+        for i, interval in enumerate(x):
+            flow_list = [1 if d['age'] > interval and d['age'] <= interval+step else 0 for d in paleoflowData]
+            flow_animation.append(flow_list)
+    
+        with open(flow_animation_fname, 'wb') as f:
+            pickle.dump(flow_animation, f)
+
+    flow_animation = flow_animation[::-1] # Reverse to go in time order
+
+
+    print('Plotting data...')
+    lats, longs = extract_coords(coldata)
+
+    plt.figure(figsize=(10.5,12))
+
+    # setup lambert conformal basemap.
+    # lat_1 is first standard parallel.
+    # lat_2 is second standard parallel (defaults to lat_1).
+    # lon_0,lat_0 is central point.
+    # rsphere=(6378137.00,6356752.3142) specifies WGS84 ellipsoid
+    # area_thresh=1000 means don't plot coastline features less
+    # than 1000 km^2 in area.
+    m = Basemap(width=7000000,height=8000000,
+                rsphere=(6378137.00,6356752.3142),\
+                resolution='l',area_thresh=3000.,projection='lcc',\
+                lat_1=35.,lat_2=55,lat_0=50,lon_0=-103.)
+    m.drawcoastlines()
+    m.drawcountries()
+    m.drawstates()
+    m.fillcontinents(color='ivory',lake_color='aqua')
+    # draw parallels and meridians.
+    m.drawparallels(np.arange(-80.,81.,10.))
+    m.drawmeridians(np.arange(-180.,181.,10.))
+    m.drawmapboundary(fill_color='aqua') 
+
+    if plot_columns:
+        x, y = m(longs, lats)
+        column_dots = m.scatter(x,y,50,marker='o',color='k', label='Gap bound packages')
+
+    if plot_paleoflows:
+        arrow_lat, arrow_lon = extract_arrows(paleoflowData)
+        us, vs = extract_uv(paleoflowData)
+        arr_x, arr_y = m(arrow_lon, arrow_lat)
+
+        flows = plt.quiver(arr_x, arr_y, us, vs, np.arctan2(us, vs)+np.pi, cmap=cmap, norm=norm, pivot='tail', angles='xy', scale=25, label='Paleocurrents')
+
+        # these are matplotlib.patch.Patch properties
+        props = dict(boxstyle='round', facecolor='black')
+
+        # place a text box in upper left in axes coords
+        megasequence_text = plt.text(0.04, 0.17, "Macrostratigraphy", transform=plt.gca().transAxes, color='white', fontsize=28,
+                verticalalignment='top', fontweight='bold', bbox=props)
+
+
+    plt.title(f"North American Macrostratigraphy By Time ({step} Ma bins)")
+
+    plt.legend(loc='best', fontsize=16, framealpha=1, handler_map={PolyCollection: HandlerImage()})
 
-if animate:
-    print('Animating plot...')
-    ani = animation.FuncAnimation(plt.gcf(), func=update, frames=range(frames), interval=frame_delay)
+    if animate:
+        print('Animating plot...')
+        ani = animation.FuncAnimation(plt.gcf(), func=update, frames=range(frames), interval=frame_delay)
 
-    if save_image:
-        print('Saving animation...')
-        ani.save(filename=out_image_fname, writer="pillow", fps=1000/frame_delay)
-        # FFwriter = animation.FFMpegWriter(fps=10)
-        # ani.save(filename="na-macrostrat.mov", writer=FFwriter)
+        if save_image:
+            print('Saving animation...')
+            ani.save(filename=out_image_fname, writer="pillow", fps=1000/frame_delay)
+            # FFwriter = animation.FFMpegWriter(fps=10)
+            # ani.save(filename="na-macrostrat.mov", writer=FFwriter)
 
-print('Processing complete!')
-if show_plot:
-    plt.show()
\ No newline at end of file
+    print('Processing complete!')
+    if show_plot:
+        plt.show()
\ No newline at end of file
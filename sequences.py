@@ -4,52 +4,55 @@ import requests as req
 import json
 import numpy as np
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 from datetime import datetime, timezone
-from scipy.ndimage import convolve1d
+from smoothing import kernel_smooth
+from async_fetch import fetch_json
 
 baseUrl = 'https://macrostrat.org/api/'
-stagesQuery = f'{baseUrl}defs/intervals?timescale_id=1'
+
+def filter_sections(sections, overlap_type, filter_zero, top, bottom):
+    '''Select the sections in one bin which have the requested overlap relationship with the bin ages top and bottom'''
+    filtered = [x for x in sections]
+    # Filter out 0 thickness packages
+    if filter_zero:
+        filtered = [x for x in filtered if x['max_thick'] != '0.00']
+
+    if overlap_type == 'initiate':
+        filtered = [x for x in filtered if x['b_age'] <= bottom and x['t_age'] < top]
+    elif overlap_type == 'truncate':
+        filtered = [x for x in filtered if x['b_age'] > bottom and x['t_age'] >= top]
+    elif overlap_type == 'endemic':
+        filtered = [x for x in filtered if x['b_age'] <= bottom and x['t_age'] >= top]
+    elif overlap_type == 'through':
+        filtered = [x for x in filtered if x['b_age'] > bottom and x['t_age'] < top]
+    elif overlap_type == 'xupper':
+        filtered = [x for x in filtered if x['t_age'] < top]
+    elif overlap_type == 'xlower':
+        filtered = [x for x in filtered if x['b_age'] > bottom]
+    return filtered
 
 def download_data(opts, header):
     if opts.use_stages:
-        res = req.get(stagesQuery)
+        res = req.get(f'{opts.base_url}defs/intervals?timescale_id=1')
         data = res.json()['success']['data']
         queries = [x['name'] for x in data]
         x = [x['t_age'] for x in data]
         xt = x
         xb = [x['b_age'] for x in data]
+        urls = [f'{opts.base_url}sections?interval_name={query}{opts.environment_query}' for query in queries]
     else:
         step = opts.num
         x = np.arange(0, opts.max_age, step)
         xt = x
         xb = x+step
+        urls = [opts.base_url+f'sections?age_top={interval}&age_bottom={interval+step}{opts.environment_query}' for interval in x]
 
-    y = np.zeros_like(x)
-    for i, interval in enumerate(tqdm(x)):
-        if opts.use_stages:
-            res = req.get(f'{baseUrl}sections?interval_name={queries[i]}{opts.environment_query}')
-        else:
-            res = req.get(baseUrl+f'sections?age_top={interval}&age_bottom={interval+step}{opts.environment_query}')
-
-        filtered = [x for x in res.json()['success']['data']]
-        # Filter out 0 thickness packages
-        if opts.filter_zero:
-            filtered = [x for x in filtered if x['max_thick'] != '0.00']
-
-        if opts.overlap_type == 'initiate':
-            filtered = [x for x in filtered if x['b_age'] <= xb[i] and x['t_age'] < xt[i]]
-        elif opts.overlap_type == 'truncate':
-            filtered = [x for x in filtered if x['b_age'] > xb[i] and x['t_age'] >= xt[i]]
-        elif opts.overlap_type == 'endemic':
-            filtered = [x for x in filtered if x['b_age'] <= xb[i] and x['t_age'] >= xt[i]]
-        elif opts.overlap_type == 'through':
-            filtered = [x for x in filtered if x['b_age'] > xb[i] and x['t_age'] < xt[i]]
-        elif opts.overlap_type == 'xupper':
-            filtered = [x for x in filtered if x['t_age'] < xt[i]]
-        elif opts.overlap_type == 'xlower':
-            filtered = [x for x in filtered if x['b_age'] > xb[i]]
+    # Responses are saved to a side file as they arrive, so an interrupted sweep resumes from the missing bins
+    responses = fetch_json(urls, opts.concurrency, opts.rate, partial_fname=opts.fname + '.partial', key=header)
 
+    y = np.zeros_like(x)
+    for i, res in enumerate(responses):
+        filtered = filter_sections(res['success']['data'], opts.overlap_type, opts.filter_zero, xt[i], xb[i])
         packages = len(filtered) #np.sum([x['col_area'] for x in filtered])
         y[i] = packages
     with open(opts.fname, 'wb') as f:
@@ -57,11 +60,6 @@ def download_data(opts, header):
         pickle.dump((header, dltime, x, y), f)
     return x, y
 
-def kernel_smooth(y, radius, edge_mode):
-    window = 2*radius+1
-    kernel = np.array([0.1, .2, 0.4,  .2 ,0.1])#np.ones(window)/window
-    return convolve1d(y, kernel, mode=edge_mode)
-
 def plot(x, y, env_title, max_age, do_smooth, use_stages, stage_axis):
     
     if stage_axis:
@@ -130,11 +128,21 @@ def main():
     parser.add_argument('--dont-filter-zero', action='store_false', dest='filter_zero', help='Do not remove zero height sediment packages.')
     parser.add_argument('--max-age', type=int, default=540, help='Maximum numeric age bin and horizontal axis value. Default 540Ma')
     parser.add_argument('--kernel-radius', type=int, default=2, metavar='RAD', help='Kernel size will be 2*RAD + 1. Default 2.')
-    parser.add_argument('--smoothing-type', choices=['gaussian', 'uniform'], default='gaussian', help='Kernel shape used to perform smoothing.')
-    parser.add_argument('--edge-mode', choices=['nearest', 'constant', 'mirror', 'reflect'], default='nearest', help='Edge behavior for smoothing. Default "nearest"')
+    parser.add_argument('--smoothing-type', choices=['gaussian', 'uniform', 'custom'], default='gaussian', help='Kernel shape used to perform smoothing.')
+    parser.add_argument('--kernel-weights', type=float, nargs='+', metavar='W', help='Weights for a custom kernel. Must be an odd number of values, overrides --kernel-radius. Requires --smoothing-type custom.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Maximum number of simultaneous Macrostrat requests. Default 4.')
+    parser.add_argument('--rate', type=float, default=5.0, help='Maximum Macrostrat requests per second. Default 5.')
+    parser.add_argument('--base-url', default=baseUrl, help=f'Macrostrat API root, e.g. a local mock server. Default {baseUrl}')
+    parser.add_argument('--edge-mode', choices=['nearest', 'constant', 'mirror', 'reflect'], help='Edge behavior for smoothing numeric age bins. Default "nearest". ' +
+                        'Does not apply to stage bins (-n 0), where kernel weights are renormalized at the ends of the series.')
     
     args = parser.parse_args()
+    edge_mode_error = '--edge-mode does not apply to stage bins, where kernel weights are renormalized at the ends of the series'
+    if args.kernel_weights is not None and args.smoothing_type != 'custom':
+        parser.error('--kernel-weights requires --smoothing-type custom')
     args.use_stages = args.num == 0
+    if args.do_smooth and args.use_stages and args.edge_mode is not None:
+        parser.error(edge_mode_error)
     download_settings = dict(bins=args.num, env=args.env, max_age=args.max_age, filter0=args.filter_zero, type=args.overlap_type)
 
     try:
@@ -157,13 +165,17 @@ def main():
                 args.env = header["env"]
                 args.overlap_type = header["type"]
                 args.use_stages = args.num == 0
+                if args.do_smooth and args.use_stages and args.edge_mode is not None:
+                    parser.error(edge_mode_error)
 
     except Exception as e:
         args.environment_query = '' if args.env is None else f'&environ_class={args.env}'
         x, y = download_data(args, download_settings)
 
     if args.do_smooth:
-        y = kernel_smooth(y, args.kernel_radius, args.edge_mode)
+        # Stages have variable width, so weight neighbours by age spacing rather than by index
+        y = kernel_smooth(y, args.kernel_radius, args.edge_mode, args.smoothing_type, 
+                          x=x if args.use_stages else None, weights=args.kernel_weights)
 
     if args.print:
         print('x,packages')
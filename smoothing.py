@@ -0,0 +1,97 @@
+import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import fftconvolve
+
+# Kernels at least this wide are applied in the frequency domain. Direct convolution is faster for the small kernels used by default.
+fft_min_radius = 32
+
+# Translation between scipy.ndimage edge modes and numpy.pad modes, used for padding before FFT convolution
+pad_modes = {'nearest': 'edge', 'constant': 'constant', 'mirror': 'reflect', 'reflect': 'symmetric', 'wrap': 'wrap'}
+
+def gaussian_kernel(radius, sigma=None):
+    '''Normalized Gaussian kernel of length 2*radius+1. sigma defaults to radius/2 so that the kernel is close to zero at its ends.'''
+    if sigma is None:
+        sigma = max(radius/2, 0.5)
+    offsets = np.arange(-radius, radius+1)
+    kernel = np.exp(-0.5*(offsets/sigma)**2)
+    return kernel/kernel.sum()
+
+def uniform_kernel(radius):
+    '''Normalized boxcar kernel of length 2*radius+1'''
+    window = 2*radius+1
+    return np.ones(window)/window
+
+def custom_kernel(weights):
+    '''Normalized kernel from user supplied weights. Must have an odd number of entries so that it is centered.'''
+    kernel = np.asarray(weights, dtype=float)
+    if kernel.ndim != 1 or len(kernel) % 2 == 0:
+        raise ValueError('Custom kernel must be a 1-D sequence with an odd number of weights')
+    if kernel.sum() == 0:
+        raise ValueError('Custom kernel weights must not sum to zero')
+    return kernel/kernel.sum()
+
+def make_kernel(smoothing_type, radius, weights=None):
+    if smoothing_type == 'gaussian':
+        return gaussian_kernel(radius)
+    if smoothing_type == 'uniform':
+        return uniform_kernel(radius)
+    if smoothing_type == 'custom':
+        if weights is None:
+            raise ValueError('Custom smoothing requires kernel weights')
+        return custom_kernel(weights)
+    raise ValueError(f'Unknown smoothing type: {smoothing_type}')
+
+def _fft_smooth(y, kernel, edge_mode):
+    '''Convolve along the last axis in the frequency domain, padding to reproduce the scipy.ndimage edge modes.'''
+    radius = len(kernel)//2
+    pad = [(0, 0)]*(y.ndim-1) + [(radius, radius)]
+    padded = np.pad(y, pad, mode=pad_modes[edge_mode])
+    return fftconvolve(padded, kernel[np.newaxis, :] if y.ndim > 1 else kernel, mode='valid', axes=-1)
+
+def _spacing_smooth(y, x, smoothing_type, radius, kernel):
+    '''Smooth samples at irregular ages x. Neighbours are weighted by their distance in age (scaled by the median bin width) and by an estimate of the width
+    of their bin, so that long stages are not under-weighted relative to short ones. Bin widths are estimated from the spacing of neighbouring ages
+    (the mean of the spacings on either side, one-sided at the ends). Weights are renormalized at the ends of the series.'''
+    x = np.asarray(x, dtype=float)
+    widths = np.abs(np.gradient(x))
+    scale = np.median(widths)
+    # Distance between every pair of bins in units of a typical bin width, oriented the same way as the sample index
+    direction = 1 if x[-1] >= x[0] else -1
+    dist = direction*(x[np.newaxis, :] - x[:, np.newaxis])/scale
+
+    if smoothing_type == 'uniform':
+        weights = (np.abs(dist) <= radius + 0.5).astype(float)
+    elif smoothing_type == 'gaussian':
+        sigma = max(radius/2, 0.5)
+        weights = np.exp(-0.5*(dist/sigma)**2)
+        weights[np.abs(dist) > radius + 0.5] = 0
+    else:
+        # Interpolate the custom kernel shape onto the fractional offsets. Reversed to match the orientation of convolve1d.
+        offsets = np.arange(-radius, radius+1)
+        weights = np.interp(dist, offsets, kernel[::-1], left=0, right=0)
+
+    weights *= widths[np.newaxis, :]
+    weights /= weights.sum(axis=1, keepdims=True)
+    return y @ weights.T
+
+def kernel_smooth(y, radius, edge_mode=None, smoothing_type='gaussian', x=None, weights=None):
+    '''Smooth y along its last axis. y may be a single series or a 2-D array with one series per row (e.g. overlap type x bins).
+    If x (bin ages) is provided, the kernel is applied on age spacing rather than sample index and weights are renormalized at the ends,
+    so edge_mode must be None. Otherwise bins are assumed equal width and edge_mode follows scipy.ndimage conventions (default nearest).
+    weights is only used by custom smoothing.'''
+    if weights is not None and smoothing_type != 'custom':
+        raise ValueError(f'Kernel weights are only used by custom smoothing, not {smoothing_type}')
+    if x is not None and edge_mode is not None:
+        raise ValueError('Edge modes do not apply to smoothing on age spacing, where weights are renormalized at the ends')
+    edge_mode = 'nearest' if edge_mode is None else edge_mode
+
+    y = np.asarray(y, dtype=float)
+    kernel = make_kernel(smoothing_type, radius, weights)
+    radius = len(kernel)//2
+
+    if x is not None:
+        return _spacing_smooth(y, x, smoothing_type, radius, kernel)
+
+    if radius >= fft_min_radius:
+        return _fft_smooth(y, kernel, edge_mode)
+    return convolve1d(y, kernel, axis=-1, mode=edge_mode)
@@ -13,6 +13,19 @@ create_table_query = 'CREATE TABLE {}(' + ', '.join((rv.ID, 'location', rv.PRECI
 # Generic insert consistent with column definition above
 insert_query = 'INSERT INTO {} VALUES (?, MakePoint(? ,? ,4326), ?, ?, ?, ?)' 
 
+# Single table of every occurrence with its age range, from which interval tables are derived
+bulk_table = 'occurrences'
+create_bulk_table_query = 'CREATE TABLE ' + bulk_table + '(' + ', '.join((rv.ID, 'location', rv.PRECISION, rv.SPECIES, rv.GENUS, rv.FAMILY, rv.MAX_MA + ' REAL', rv.MIN_MA + ' REAL')) + ')'
+insert_bulk_query = 'INSERT INTO ' + bulk_table + ' VALUES (?, MakePoint(? ,? ,4326), ?, ?, ?, ?, ?, ?)'
+create_bulk_index_queries = ['CREATE INDEX IF NOT EXISTS ' + bulk_table + '_' + field + '_idx ON ' + bulk_table + '(' + field + ')' for field in (rv.MAX_MA, rv.MIN_MA)]
+select_bulk_ages_query = 'SELECT rowid, ' + rv.MAX_MA + ', ' + rv.MIN_MA + ' FROM ' + bulk_table
+create_selected_rows_query = 'CREATE TEMP TABLE IF NOT EXISTS selected_rows(id INTEGER PRIMARY KEY)'
+clear_selected_rows_query = 'DELETE FROM temp.selected_rows'
+insert_selected_row_query = 'INSERT INTO temp.selected_rows VALUES (?)'
+# Copy the selected rows (rowids in temp table selected_rows) into an interval table with the usual columns
+derive_table_query = ('INSERT INTO {} SELECT ' + ', '.join((rv.ID, 'location', rv.PRECISION, rv.SPECIES, rv.GENUS, rv.FAMILY)) + 
+                      ' FROM ' + bulk_table + ' WHERE rowid IN (SELECT id FROM temp.selected_rows)')
+
 def create_union_view(view_name, table_names):
     '''Create a view which includes all entries from a list of tables. Drops existing view before creating this one.'''
     query = f"DROP VIEW IF EXISTS {view_name};\n"  # Drop view if it exists
@@ -25,6 +38,7 @@ def create_union_view(view_name, table_names):
 
 # These queries need initialization
 copyQuery = copyGlobalQuery = countQuery = countUnion = ''
+createGridQuery = gridPointsQuery = gridCopyQuery = union_grid_query = grid_suffix = ''
 
 def init_sql_statements(taxon_field, threshold_distance_deg):
     '''Initialize statements which require static setting information (specifically, taxon level and spatial search distance) as part of the query'''
@@ -52,6 +66,49 @@ def init_sql_statements(taxon_field, threshold_distance_deg):
         'WHERE {table1}.' + taxon_field + ' = {table2}.' + taxon_field + ')'
     )
 
+    # Distinct (taxon, location) points of a table, labelled with the grid cell they fall in. Cells are slightly wider than the threshold distance,
+    # so any two points within the threshold are in the same or adjacent cells. Offsets keep coordinates positive so that CAST rounds down.
+    cell = max(threshold_distance_deg, 1e-6)*(1 + 1e-6)
+    # Grid tables are kept between runs, so their names record the settings they were built with
+    global grid_suffix
+    grid_suffix = '_grid_' + taxon_field + '_' + str(threshold_distance_deg).replace('.', 'p').replace('-', 'm')
+    global createGridQuery
+    createGridQuery = (
+    'CREATE TABLE IF NOT EXISTS {gridtable} AS ' +
+    'SELECT ' + taxon_field + ' AS taxon, ST_X(location) AS x, ST_Y(location) AS y, ' +
+        'CAST((ST_X(location) + 180) / ' + repr(cell) + ' AS INTEGER) AS cx, ' +
+        'CAST((ST_Y(location) + 90) / ' + repr(cell) + ' AS INTEGER) AS cy ' +
+    'FROM {table} WHERE ' + taxon_field + ' IS NOT NULL AND location IS NOT NULL ' +
+    'GROUP BY taxon, x, y'
+    )
+
+    # Temporary grid table of several intervals (e.g. a union view), built from the grid tables of its members. UNION removes points shared between members.
+    global union_grid_query
+    union_grid_query = 'CREATE TEMP TABLE {gridtable} AS {grids}'
+
+    # Distinct points of grid1 which have a point of the same taxon in grid2 within the threshold distance. Only the 3x3 block of neighbouring cells is searched.
+    global gridPointsQuery
+    gridPointsQuery = (
+    'CREATE TEMP TABLE {pointtable} AS ' +
+    'SELECT g1.taxon, g1.x, g1.y FROM {grid1} AS g1 ' +
+    'WHERE EXISTS (' +
+        'SELECT 1 ' +
+        'FROM {grid2} AS g2 ' +
+        'WHERE g2.taxon = g1.taxon AND g2.cx BETWEEN g1.cx - 1 AND g1.cx + 1 AND g2.cy BETWEEN g1.cy - 1 AND g1.cy + 1' +
+        ' AND ST_Distance(MakePoint(g1.x, g1.y, 4326), MakePoint(g2.x, g2.y, 4326)) <= ' + str(threshold_distance_deg) + ' )'
+    )
+
+    # Same result as copyQuery, selecting the occurrences of table1 located at a crossing point
+    global gridCopyQuery
+    gridCopyQuery = (
+    'CREATE TABLE IF NOT EXISTS {newtable} AS ' +
+    'SELECT * FROM {table1} ' +
+    'WHERE EXISTS (' +
+        'SELECT 1 ' +
+        'FROM {pointtable} AS p ' +
+        'WHERE p.taxon = {table1}.' + taxon_field + ' AND p.x = ST_X({table1}.location) AND p.y = ST_Y({table1}.location) )'
+    )
+
     # Count distinct taxa (as opposed to occurrences) in this table
     global countQuery
     countQuery = 'SELECT COUNT(DISTINCT ' + taxon_field + ') FROM {}'
@@ -60,10 +117,58 @@ def init_sql_statements(taxon_field, threshold_distance_deg):
     global countUnion
     countUnion = '(SELECT ' + taxon_field + ' FROM {table1} UNION SELECT ' + taxon_field + ' FROM {table2})'
 
+# Per-boundary results, keyed by a fingerprint of the settings used to compute them
+create_results_table_query = 'CREATE TABLE IF NOT EXISTS boundary_results(fingerprint TEXT, bdry_no INTEGER, result TEXT, PRIMARY KEY (fingerprint, bdry_no))'
+insert_result_query = 'INSERT OR REPLACE INTO boundary_results VALUES (?, ?, ?)'
+select_results_query = 'SELECT bdry_no, result FROM boundary_results WHERE fingerprint = ?'
+
+def gridTable(table):
+    return table + grid_suffix
+
+def grid_copy_statements(newtable, table1, table2, members1=None, members2=None):
+    '''Statements which create the same table as copyQuery, but test distances between distinct (taxon, location) points in neighbouring grid cells
+    instead of between every pair of occurrences. members1 and members2 are the tables holding the occurrences of table1 and table2 (default the tables
+    themselves). Grid tables of member tables are kept (see gridTable) so each interval is only aggregated once. A side with several members is searched
+    through a temporary union of their grids, dropped when the copy is done.'''
+    members1 = members1 or [table1]
+    members2 = members2 or [table2]
+    statements = []
+    for table in dict.fromkeys(members1 + members2):
+        statements += [createGridQuery.format(gridtable=gridTable(table), table=table), create_grid_index_query.format(gridTable(table))]
+
+    temporary = []
+    def side_grid(members, name):
+        if len(members) == 1:
+            return gridTable(members[0])
+        temporary.append(name)
+        statements.extend([dropTableQuery.format(name),
+                           union_grid_query.format(gridtable=name, grids=' UNION '.join(f'SELECT * FROM {gridTable(table)}' for table in members)),
+                           create_grid_index_query.format(name)])
+        return name
+
+    grid1 = side_grid(members1, newtable + '_grid1')
+    grid2 = side_grid(members2, newtable + '_grid2')
+    pointtable = newtable + '_points'
+    return statements + [dropTableQuery.format(pointtable),
+                         gridPointsQuery.format(pointtable=pointtable, grid1=grid1, grid2=grid2),
+                         create_point_index_query.format(pointtable),
+                         gridCopyQuery.format(newtable=newtable, table1=table1, pointtable=pointtable),
+                         dropTableQuery.format(pointtable)] + [dropTableQuery.format(name) for name in temporary]
+
+create_grid_index_query = 'CREATE INDEX IF NOT EXISTS {0}_idx ON {0}(taxon, cx, cy)'
+create_point_index_query = 'CREATE INDEX {0}_idx ON {0}(taxon, x, y)'
+
 # Generic drop table
 dropTableQuery = 'DROP TABLE IF EXISTS {}'
 dropViewQuery = 'DROP VIEW IF EXISTS {}'
 
+def configure_disk_connection(conn, cache_mb, mmap_mb):
+    '''Tune a connection to an on-disk database so it can be used in place instead of being copied into memory.
+    Pages are read through a memory map and a large page cache, and WAL lets worker processes read while new tables are written.'''
+    conn.execute(f'PRAGMA cache_size = -{int(cache_mb*1024)}')
+    conn.execute(f'PRAGMA mmap_size = {int(mmap_mb*1024*1024)}')
+    conn.execute('PRAGMA journal_mode = WAL')
+
 def load_db_from_file(conn, fname):
     # Connect to the SQLite database on disk
     with sqlite3.connect(fname) as conn_disk:
@@ -76,3 +181,17 @@ def save_db_to_file(conn, fname):
     with sqlite3.connect(fname) as conn_disk:
         # Backup the data from memory to disk
         conn.backup(conn_disk)
+
+
+def copy_tables_to_file(conn, fname, tables):
+    '''Write only the named tables from conn to the database file fname, replacing any existing copies, in a single transaction'''
+    conn.commit()
+    conn.execute('ATTACH DATABASE ? AS checkpoint', (fname,))
+    try:
+        conn.execute('BEGIN')
+        for table in tables:
+            conn.execute(f'DROP TABLE IF EXISTS checkpoint.{table}')
+            conn.execute(f'CREATE TABLE checkpoint.{table} AS SELECT * FROM main.{table}')
+        conn.commit()
+    finally:
+        conn.execute('DETACH DATABASE checkpoint')
@@ -0,0 +1,102 @@
+import os
+import math
+import spatialite as sqlite3
+from multiprocess import Pool
+from profiling import Trace
+
+# Rows read from the occurrence database per fetch while writing tiles. Bounds memory use while tiling very large intervals.
+fetch_rows = 50000
+
+create_tile_table_query = 'CREATE TABLE {}(tx INTEGER, ty INTEGER, oid, taxon, x REAL, y REAL)'
+create_tile_index_query = 'CREATE INDEX {0}_idx ON {0}(tx, ty, taxon)'
+insert_tile_query = 'INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?)'
+select_tiles_query = 'SELECT DISTINCT tx, ty FROM {}'
+
+# Lower occurrences in one tile with an upper occurrence of the same taxon within the threshold distance in the same tile.
+# Both tables hold the tile's extent plus the overlap, so every pair within the threshold is seen by the tile containing the lower occurrence.
+# An interval made of several tables (a view) is searched one member table at a time, so each table only needs tiling once.
+join_tile_query = 'SELECT DISTINCT l.oid FROM {lower} AS l WHERE l.tx = :tx AND l.ty = :ty AND ({exists})'
+exists_tile_query = (
+    'EXISTS (' +
+        'SELECT 1 FROM {upper} AS u ' +
+        'WHERE u.tx = :tx AND u.ty = :ty AND u.taxon = l.taxon' +
+        ' AND ST_Distance(MakePoint(l.x, l.y, 4326), MakePoint(u.x, u.y, 4326)) <= {threshold} )'
+)
+
+create_crossing_ids_query = 'CREATE TEMP TABLE IF NOT EXISTS crossing_ids(oid PRIMARY KEY)'
+clear_crossing_ids_query = 'DELETE FROM temp.crossing_ids'
+insert_crossing_id_query = 'INSERT OR IGNORE INTO temp.crossing_ids VALUES (?)'
+copy_crossing_query = 'CREATE TABLE IF NOT EXISTS {newtable} AS SELECT * FROM {table1} WHERE {id_field} IN (SELECT oid FROM temp.crossing_ids)'
+
+def tile_range(coord, offset, size, overlap):
+    '''Indices of the tiles whose extent, widened by overlap on each side, contains coord'''
+    return range(math.floor((coord + offset - overlap)/size), math.floor((coord + offset + overlap)/size) + 1)
+
+def tileTable(table):
+    return table + '_tiles'
+
+def write_tiles(conn, table, tile_conn, id_field, taxon_field, size, overlap):
+    '''Copy the occurrences of table (read through conn) into its tile table in the tile database.
+    Each occurrence is written to every tile whose extent plus overlap contains it.'''
+    tiles = tileTable(table)
+    tile_conn.execute(create_tile_table_query.format(tiles))
+    cursor = conn.execute(f'SELECT {id_field}, {taxon_field}, ST_X(location), ST_Y(location) FROM {table} ' +
+                          f'WHERE {taxon_field} IS NOT NULL AND location IS NOT NULL')
+    while True:
+        rows = cursor.fetchmany(fetch_rows)
+        if not rows:
+            break
+        tile_conn.executemany(insert_tile_query.format(tiles), ((tx, ty, oid, taxon, x, y) for oid, taxon, x, y in rows
+                                                                 for tx in tile_range(x, 180, size, overlap)
+                                                                 for ty in tile_range(y, 90, size, overlap)))
+    tile_conn.execute(create_tile_index_query.format(tiles))
+    tile_conn.commit()
+
+_tile_conn = None
+
+def _open_tile_db(tile_fname):
+    global _tile_conn
+    _tile_conn = sqlite3.connect(tile_fname)
+
+def _join_tile(task):
+    lower, uppers, threshold, tx, ty = task
+    exists = ' OR '.join(exists_tile_query.format(upper=upper, threshold=threshold) for upper in uppers)
+    query = join_tile_query.format(lower=lower, exists=exists)
+    return [row[0] for row in _tile_conn.execute(query, dict(tx=tx, ty=ty))]
+
+def tiled_copy(cursor, newtable, table1, table2, members1, members2, tile_fname, id_field, taxon_field, threshold_distance_deg, size,
+               processes=None, trace=Trace(False), stage=None, boundary=None):
+    '''Create the same table as copyQuery without joining table1 and table2 in one query.
+    members1 and members2 are the tables holding the occurrences of table1 and table2 (the tables themselves, or the members of a union view).
+    Each member table is split once into overlapping lat/lon tiles on disk, tiles are joined independently across a process pool,
+    and the crossing occurrences are collected (without duplicates) by id. Each step is recorded in trace under stage and boundary.'''
+    conn = cursor.connection
+    if conn.execute(f'SELECT 1 FROM sqlite_schema WHERE type="table" AND name=?', (newtable,)).fetchone() is not None:
+        return
+
+    with sqlite3.connect(tile_fname) as tile_conn:
+        tiled = {name for (name,) in tile_conn.execute('SELECT name FROM sqlite_schema WHERE type="table"')}
+        for table in dict.fromkeys(members1 + members2):
+            if tileTable(table) not in tiled:
+                with trace.span(stage, boundary, 'tile ' + table):
+                    write_tiles(conn, table, tile_conn, id_field, taxon_field, size, threshold_distance_deg)
+        tiles = {table: set(tile_conn.execute(select_tiles_query.format(tileTable(table))).fetchall()) for table in dict.fromkeys(members1 + members2)}
+
+    upper_tiles = set().union(*(tiles[table] for table in members2))
+    uppers = [tileTable(table) for table in members2]
+    tasks = [(tileTable(table), uppers, threshold_distance_deg, tx, ty) for table in members1 for tx, ty in sorted(tiles[table] & upper_tiles)]
+    conn.execute(create_crossing_ids_query)
+    conn.execute(clear_crossing_ids_query)
+    with trace.span(stage, boundary, f'join {len(tasks)} tiles of {table1} and {table2}'):
+        with Pool(processes, initializer=_open_tile_db, initargs=(tile_fname,)) as pool:
+            for ids in pool.imap_unordered(_join_tile, tasks):
+                conn.executemany(insert_crossing_id_query, ((id,) for id in ids))
+
+    trace.execute(cursor, copy_crossing_query.format(newtable=newtable, table1=table1, id_field=id_field), stage, boundary)
+    conn.execute(clear_crossing_ids_query)
+
+def reset_tiles(tile_fname):
+    '''Remove the tile database so tiles are rebuilt from the current tables and settings'''
+    for fname in (tile_fname, tile_fname + '-wal', tile_fname + '-shm'):
+        if os.path.exists(fname):
+            os.remove(fname)
@@ -7,12 +7,19 @@ import spatialite as sqlite3
 import pickle
 import csv
 import sql_statements as sql
+import resampling
+import result_store
+import tiling
 import paleobiodb_interface as pbdb
 from paleobiodb_interface import rv
 from multiprocess import Manager
 from strenum import StrEnum
 from enum import auto
 import sys
+import os
+import json
+from profiling import Trace
+from interval_index import AgeIndex
 
 class TimeLevel(StrEnum):
     eon = auto()
@@ -58,12 +65,34 @@ env_type = None # None, terr, marine
 taxa_filt = None # plantae, prokaryota,eukaryota^plantae
 count_global_crossings = True
 find_gappers = False # Include taxa which straddle a boundary with any number of series gaps
+all_levels = False # Also analyze boundaries at every coarser TimeLevel than search_lvl, from the same tables. One CSV per level
+resample_method = None # None, bootstrap, rarefaction. Adds confidence interval columns for the local and global _pct results. bootstrap intervals are bias corrected to bracket _pct; rarefaction intervals are for the proportion at resample_size
+resample_replicates = 10000
+resample_confidence = 0.95
+resample_size = None # Occurrences drawn per interval for rarefaction. None uses the smaller interval of each boundary
+bulk_download = False # Download all occurrences with their age ranges at once and assign them to intervals locally. Interval tables are named with age_rule, apart from per-interval downloads
+age_rule = 'major' # contain, major, overlap. How occurrence age ranges are matched to intervals in bulk_download mode (see PaleoBioDB timerule)
+load_db_into_memory = False # Copy the whole database into memory for downloading. Otherwise it is used in place through mmap
+db_cache_mb = 1024 # SQLite page cache for the on-disk database
+db_mmap_mb = 16384 # Upper limit of the database file mapped into memory
+checkpoint_every = 10 # In memory mode, downloaded interval tables are written to database_filename after this many downloads
+resume_boundaries = True # Reuse boundary results saved by an earlier run with the same settings
+grid_preaggregate = False # Merge duplicate occurrence locations and search only neighbouring grid cells in the distance test. Results are identical
+tiled_join = False # Split each distance test into overlapping lat/lon tiles on disk, joined in parallel with bounded memory. Results are identical. For tables too large to join at once
+tile_size_deg = 20 # Width of each tile before the threshold_distance_deg overlap is added
+tile_processes = None # Processes joining tiles. None uses every CPU
+profile_run = False # Record timing, work and query plans for each statement and download. Written next to csv_filename
 
 # Provide the filename for the CSV file
 csv_filename = 'fbwg_nlsss_base.csv'
+result_store_filename = 'nlsss_results.sqlite' # Every exported result is also added here, keyed by settings, for comparing runs. None to disable
 
 column_filename = 'column.pkl'
+intervals_filename = 'intervals.pkl'
 database_filename = 'paleobiodb.sqlite'
+tile_database_filename = 'tiles.sqlite' # Scratch database of tiled tables, rebuilt on every run
+
+trace = Trace(profile_run)
 
 def taxon_field_picker(level):
     if level=='species':
@@ -80,20 +109,26 @@ pbdb.init_paleobiodb_queries(taxon_level, env_type, taxa_filt)
 
 # Select result labels based on the selected taxon analysis level
 total_res_label = 'total_' + taxon_level
-label_temp = list('nlsss')
-label_temp[2] = TimeLevel.abbreviate_levels(search_lvl)
-label_temp[4] = taxon_level[0]
 
-global_temp = label_temp.copy()
-global_temp[1] = 'g'
+def result_labels(level):
+    '''Local, global, local gapper and global gapper result labels for boundaries at the given TimeLevel'''
+    label_temp = list('nlsss')
+    label_temp[2] = TimeLevel.abbreviate_levels(level)
+    label_temp[4] = taxon_level[0]
+
+    global_temp = label_temp.copy()
+    global_temp[1] = 'g'
+
+    local_label = ''.join(label_temp)
+    global_label = ''.join(global_temp)
 
-local_label = ''.join(label_temp)
-global_label = ''.join(global_temp)
+    label_temp[-2] = 'j' # j for "Jumping"
+    local_gap_label = ''.join(label_temp)
+    global_temp[-2] = 'j'
+    global_gap_label = ''.join(global_temp)
+    return local_label, global_label, local_gap_label, global_gap_label
 
-label_temp[-2] = 'j' # j for "Jumping"
-local_gap_label = ''.join(label_temp)
-global_temp[-2] = 'j'
-global_gap_label = ''.join(global_temp)
+local_label, global_label, local_gap_label, global_gap_label = result_labels(search_lvl)
 
 
 # Original Wise algorithm
@@ -154,16 +189,86 @@ def queryColumn():
     t.close()
     return column
 
+def queryIntervals():
+    '''Every interval in the timescale, at all levels. Used to find the coarser intervals that each column interval belongs to.'''
+    res = requests.get(pbdb.api_base+pbdb.interval_request)
+    return res.json()['records']
+
+def level_column(column, intervals, level):
+    '''Column of intervals at a coarser TimeLevel, built by grouping consecutive intervals of column by their ancestor at that level.
+    Intervals already at or above level are kept as they are. Each entry is the ancestor's record, with 'members' listing the tables of the
+    column intervals it covers and 'table' naming a view over them, so no occurrences are queried again.'''
+    by_id = {record[rv.ID]: record for record in intervals}
+
+    def ancestor(interval):
+        record = interval
+        while TimeLevel[record[rv.LEVEL]].index() > level.index() and record.get(rv.PARENT) in by_id:
+            record = by_id[record[rv.PARENT]]
+        return record
+
+    coarse = []
+    for _, members in itertools.groupby(column, key=lambda interval: ancestor(interval)[rv.ID]):
+        members = list(members)
+        record = dict(ancestor(members[0]))
+        record['members'] = [intervalTable(member) for member in members]
+        record['table'] = tableName(record[rv.NAME]) + '_' + level + 'view'
+        coarse.append(record)
+    return coarse
+
+def create_level_views(column):
+    '''Create the views used by a column from level_column. With grid_preaggregate, boundaries between views search their members' grid tables.'''
+    with sqlite3.connect(database_filename) as conn:
+        cursor = conn.cursor()
+        for interval in column:
+            cursor.executescript(sql.create_union_view(interval['table'], interval['members']))
+        conn.commit()
+
+def run_settings(level=None):
+    '''Settings which affect boundary results. A coarser level built from unions of the search_lvl tables (all_levels) records the level
+    it was derived from, so that its results are never mixed up with those of a run downloaded at that level.'''
+    settings = dict(search_lvl=str(search_lvl if level is None else level), threshold_distance_deg=threshold_distance_deg, taxon_level=taxon_level, env_type=env_type,
+                    taxa_filt=taxa_filt, count_global_crossings=count_global_crossings, find_gappers=find_gappers,
+                    bulk_download=bulk_download, age_rule=age_rule if bulk_download else None)
+    if level is not None and level != search_lvl:
+        settings['derived_from'] = str(search_lvl)
+    return settings
+
+def settings_fingerprint(level=None):
+    '''Short hash of the settings which affect boundary results. Stored with each result so that a re-run only reuses compatible results.'''
+    return result_store.fingerprint(run_settings(level))
+
+def store_settings(level=None):
+    '''Settings which identify a run in the result store, including those of the confidence interval columns'''
+    return dict(run_settings(level), resample_method=resample_method, resample_replicates=resample_replicates,
+                resample_confidence=resample_confidence, resample_size=resample_size)
+
 def tableName(textname):
-    return textname.replace(' ', '_').lower()
+    '''Table of an interval's occurrences. Tables derived in bulk_download mode depend on age_rule, so the rule is part of their name'''
+    name = textname.replace(' ', '_').lower()
+    return f'{name}_{age_rule}' if bulk_download else name
+
+def intervalTable(interval):
+    '''Table (or view) holding an interval's occurrences'''
+    return interval.get('table') or tableName(interval[rv.NAME])
+
+def memberTables(intervals):
+    '''Tables (not views) holding the occurrences of intervals'''
+    return [table for interval in intervals for table in interval.get('members', [intervalTable(interval)])]
 
 def retreive_paleobiodb_data(column):
     # Connect to a SQLite database (which includes SpatiaLite)
-    with sqlite3.connect(':memory:') as conn:
+    if load_db_into_memory:
+        # Copy the database from disk to memory. This needs as much RAM as the database file and takes time in proportion to its size.
+        conn = sqlite3.connect(':memory:')
+        sql.load_db_from_file(conn, database_filename)
+    else:
+        # New tables are written straight to disk, so there is nothing to copy at startup or at the end
+        conn = sqlite3.connect(database_filename)
+        sql.configure_disk_connection(conn, db_cache_mb, db_mmap_mb)
+
+    with conn:
         success = True
 
-        # Attach the database from disk to memory. For a variety of setups, this will shave minutes off processing time
-        sql.load_db_from_file(conn, database_filename)
         print('spatialite version: ' + conn.execute(sql.spatialite_query).fetchone()[0])
 
         # Perform spatial queries using SpatiaLite functions
@@ -179,32 +284,110 @@ def retreive_paleobiodb_data(column):
                       occurrence[rv.FAMILY])
 
         print('Downloading fossil occurrence data...')
-        for interval in tqdm(column):
-            tablename = tableName(interval[rv.NAME])
-
-            cursor.execute(sql.check_table_query.format(tablename))
-            if cursor.fetchone() is not None:
-                continue
-            
-            res = requests.get(pbdb.api_base+pbdb.occurrence_request.format(interval[rv.ID]))
-            try:
-                occs = res.json()['records']
-            except KeyError:
-                print(f'Error returned when querying PaleoBioDB for {interval[rv.NAME]}. Please refresh geological column and download data again.')
-                success = False
-                continue
-            # Load result into database
-            cursor.execute(sql.create_table_query.format(tablename))
-            cursor.executemany(sql.insert_query.format(tablename), (get_insert_values(occ) for occ in occs))
-            conn.commit()
-
-        sql.save_db_to_file(conn, database_filename)
+        # Tables downloaded since the last checkpoint. Only these are written back to disk, and they are written even if the loop is interrupted.
+        unsaved = []
+        try:
+            if bulk_download:
+                success = load_bulk_occurrences(conn, column, get_insert_values, unsaved if load_db_into_memory else [])
+            else:
+                for interval in tqdm(column):
+                    tablename = tableName(interval[rv.NAME])
+
+                    cursor.execute(sql.check_table_query.format(tablename))
+                    if cursor.fetchone() is not None:
+                        continue
+                
+                    res = trace.request(pbdb.api_base+pbdb.occurrence_request.format(interval[rv.ID]), 'download', interval[rv.NAME])
+                    try:
+                        occs = res.json()['records']
+                    except KeyError:
+                        print(f'Error returned when querying PaleoBioDB for {interval[rv.NAME]}. Please refresh geological column and download data again.')
+                        success = False
+                        continue
+                    # Load result into database. sqlite3 commits CREATE TABLE on its own unless a transaction is open, so the table and its
+                    # rows are written in one transaction: an interrupted insert must not leave an empty table that later runs would skip.
+                    cursor.execute('BEGIN')
+                    cursor.execute(sql.create_table_query.format(tablename))
+                    cursor.executemany(sql.insert_query.format(tablename), (get_insert_values(occ) for occ in occs))
+                    conn.commit()
+                    if load_db_into_memory:
+                        unsaved.append(tablename)
+
+                    if len(unsaved) >= checkpoint_every:
+                        sql.copy_tables_to_file(conn, database_filename, unsaved)
+                        unsaved = []
+        finally:
+            if unsaved:
+                sql.copy_tables_to_file(conn, database_filename, unsaved)
         return success
 
-def find_bounary_crossers(column):
-    print('Processing boundaries...')
+def load_bulk_occurrences(conn, column, get_insert_values, created):
+    '''Download every occurrence in the column's time span with a single request, then derive any missing interval tables locally
+    by matching occurrence age ranges to interval ages. Tables are appended to created as they are made. Returns False if the download failed.'''
+    cursor = conn.cursor()
+
+    cursor.execute(sql.check_table_query.format(sql.bulk_table))
+    if cursor.fetchone() is None:
+        youngest = min(interval[rv.MIN_MA] for interval in column)
+        oldest = max(interval[rv.MAX_MA] for interval in column)
+        res = trace.request(pbdb.api_base+pbdb.bulk_occurrence_request.format(youngest, oldest), 'download', sql.bulk_table)
+        try:
+            occs = res.json()['records']
+        except KeyError:
+            print(f'Error returned when querying PaleoBioDB for occurrences from {youngest} to {oldest} Ma.')
+            return False
+        # One transaction for the table and its rows, so an interrupted insert leaves no table and the download is retried
+        cursor.execute('BEGIN')
+        cursor.execute(sql.create_bulk_table_query)
+        cursor.executemany(sql.insert_bulk_query, (get_insert_values(occ) + (float(occ[rv.MAX_MA]), float(occ[rv.MIN_MA])) for occ in occs))
+        conn.commit()
+        created.append(sql.bulk_table)
+
+    # Age indexes for ad hoc queries. Recreated if the table was checkpointed from memory, which does not copy indexes.
+    for query in sql.create_bulk_index_queries:
+        cursor.execute(query)
+
+    missing = [interval for interval in column if cursor.execute(sql.check_table_query.format(tableName(interval[rv.NAME]))).fetchone() is None]
+    if not missing:
+        return True
+
+    print('Assigning occurrences to intervals...')
+    rows = cursor.execute(sql.select_bulk_ages_query).fetchall()
+    index = AgeIndex([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+    del rows
+    cursor.execute(sql.create_selected_rows_query)
+    for interval in tqdm(missing):
+        tablename = tableName(interval[rv.NAME])
+        cursor.execute('BEGIN')
+        cursor.execute(sql.clear_selected_rows_query)
+        cursor.executemany(sql.insert_selected_row_query, ((int(id),) for id in index.select(interval[rv.MIN_MA], interval[rv.MAX_MA], age_rule)))
+        cursor.execute(sql.create_table_query.format(tablename))
+        cursor.execute(sql.derive_table_query.format(tablename))
+        conn.commit()
+        created.append(tablename)
+    return True
+
+def find_bounary_crossers(column, level=search_lvl):
+    print(f'Processing {level} boundaries...')
+    local_label, global_label, local_gap_label, global_gap_label = result_labels(level)
     manager = Manager()
     result = manager.dict()
+    worker_trace = Trace(trace.enabled, manager.list())
+    fingerprint = settings_fingerprint(level)
+
+    windows = dict(enumerate(more_itertools.windowed(column, 2), 1))
+    # Boundaries finished by an earlier run are loaded rather than recomputed.
+    # Only results for this column's boundaries are kept, since a saved run may have used a longer or different column
+    with sqlite3.connect(database_filename) as conn:
+        conn.execute(sql.create_results_table_query)
+        if resume_boundaries:
+            for id, res in conn.execute(sql.select_results_query, (fingerprint,)):
+                res = json.loads(res)
+                if id in windows and res['boundary'] == '/'.join((windows[id][0][rv.NAME], windows[id][1][rv.NAME])):
+                    result[id] = res
+    remaining = [(id, window) for id, window in windows.items() if id not in result]
+    if len(remaining) < len(column)-1:
+        print(f'Reusing saved results for {len(column)-1-len(remaining)} boundaries.')
     
     def worker_tasks(input):
         # Algorithm:
@@ -218,96 +401,148 @@ def find_bounary_crossers(column):
         # {id: {boundary: (name), total_species:, ngsss:, nlsss:, ngsjs:, nlsjs:, ngsss_pct:, nlsss_pct:, ngsjs_pct:, nlsjs_pct:}}
         id, window = input
         below, above = window
+
+        def copy_local(cursor, newtable, table1, table2, members1, members2, stage, bname):
+            if tiled_join:
+                tiling.tiled_copy(cursor, newtable, table1, table2, members1, members2, tile_database_filename, rv.ID, taxon_field,
+                                  threshold_distance_deg, tile_size_deg, tile_processes, worker_trace, stage, bname)
+            elif grid_preaggregate:
+                for statement in sql.grid_copy_statements(newtable, table1, table2, members1, members2):
+                    worker_trace.execute(cursor, statement, stage, bname)
+            else:
+                worker_trace.execute(cursor, sql.copyQuery.format(newtable=newtable, table1=table1, table2=table2), stage, bname)
+
         with sqlite3.connect(database_filename, 60) as conn:
-            conn.execute("PRAGMA journal_mode=WAL")
+            sql.configure_disk_connection(conn, db_cache_mb, db_mmap_mb)
             # Perform spatial queries using SpatiaLite functions
             cursor = conn.cursor()
             cursor.execute("BEGIN IMMEDIATE")
 
-            lowertable = tableName(below[rv.NAME])
-            uppertable = tableName(above[rv.NAME])
-            res = {'boundary': '/'.join((below[rv.NAME], above[rv.NAME]))}
+            lowertable = intervalTable(below)
+            uppertable = intervalTable(above)
+            bname = '/'.join((below[rv.NAME], above[rv.NAME]))
+            res = {'boundary': bname}
 
-            cursor.execute(sql.countQuery.format(lowertable))
+            worker_trace.execute(cursor, sql.countQuery.format(lowertable), 'count', bname)
             res[total_res_label] = cursor.fetchone()[0]
 
             if find_gappers:
-                cursor.executescript(sql.create_union_view(lowertable+'_olderview', [tableName(age[rv.NAME]) for age in itertools.islice(column, 0, id)]))
+                worker_trace.executescript(cursor, sql.create_union_view(lowertable+'_olderview', [intervalTable(age) for age in itertools.islice(column, 0, id)]), 'gapper_views', bname)
                 conn.commit()
-                cursor.executescript(sql.create_union_view(uppertable+'_youngerview', [tableName(age[rv.NAME]) for age in itertools.islice(column, id, None)]))
+                worker_trace.executescript(cursor, sql.create_union_view(uppertable+'_youngerview', [intervalTable(age) for age in itertools.islice(column, id, None)]), 'gapper_views', bname)
                 conn.commit()
 
-                cursor.execute(sql.copyQuery.format(newtable=lowertable + '_localgappers', table1=lowertable + '_olderview', table2=uppertable + '_youngerview'))
+                copy_local(cursor, lowertable + '_localgappers', lowertable + '_olderview', uppertable + '_youngerview',
+                           memberTables(itertools.islice(column, 0, id)), memberTables(itertools.islice(column, id, None)), 'copyQuery_gappers', bname)
                 conn.commit()
 
-                cursor.execute(sql.countQuery.format(lowertable + '_localgappers'))
+                worker_trace.execute(cursor, sql.countQuery.format(lowertable + '_localgappers'), 'count', bname)
                 res[local_gap_label] = cursor.fetchone()[0]
 
                 if count_global_crossings:
-                    cursor.execute(sql.copyGlobalQuery.format(newtable=lowertable + '_globalgappers', table1=lowertable + '_olderview', table2=uppertable + '_youngerview'))
+                    worker_trace.execute(cursor, sql.copyGlobalQuery.format(newtable=lowertable + '_globalgappers', table1=lowertable + '_olderview', table2=uppertable + '_youngerview'), 'copyGlobalQuery_gappers', bname)
                     conn.commit()
 
-                    cursor.execute(sql.countQuery.format(lowertable + '_globalgappers'))
+                    worker_trace.execute(cursor, sql.countQuery.format(lowertable + '_globalgappers'), 'count', bname)
                     res[global_gap_label] = cursor.fetchone()[0]
 
             if count_global_crossings:
                 # This query only deletes occurrences without any members that cross the boundary
                 # Only needed if we want to count global crossings, since the distance query will also delete occurrences without any crossings
-                cursor.execute(sql.copyGlobalQuery.format(newtable=lowertable + '_globalcrossings', table1=lowertable, table2=uppertable))
+                worker_trace.execute(cursor, sql.copyGlobalQuery.format(newtable=lowertable + '_globalcrossings', table1=lowertable, table2=uppertable), 'copyGlobalQuery', bname)
                 conn.commit()
 
-                cursor.execute(sql.countQuery.format(lowertable + '_globalcrossings'))
+                worker_trace.execute(cursor, sql.countQuery.format(lowertable + '_globalcrossings'), 'count', bname)
                 res[global_label] = cursor.fetchone()[0]
 
             # Delete occurrences of species unique to lower unit or without members above the boundary closer than the threshold distance.
-            cursor.execute(sql.copyQuery.format(newtable=lowertable + '_localcrossings', table1=lowertable, table2=uppertable))
+            copy_local(cursor, lowertable + '_localcrossings', lowertable, uppertable, memberTables([below]), memberTables([above]), 'copyQuery', bname)
             conn.commit()
 
-            cursor.execute(sql.countQuery.format(lowertable + '_localcrossings'))
+            worker_trace.execute(cursor, sql.countQuery.format(lowertable + '_localcrossings'), 'count', bname)
             res[local_label] = cursor.fetchone()[0]
 
+            # Persist as soon as the boundary is done so that an interrupted run can resume from here
+            cursor.execute(sql.insert_result_query, (fingerprint, id, json.dumps(res)))
+            conn.commit()
             result[id] = res
 
-    ppool = manager.Pool(1)
-    with tqdm(total=len(column)-1) as pbar:
-        for _ in ppool.imap_unordered(worker_tasks, list(enumerate(more_itertools.windowed(column, 2), 1))):
-            pbar.update()
-
-    ppool.close()
-    ppool.join()
+    with tqdm(total=len(column)-1, initial=len(column)-1-len(remaining)) as pbar:
+        if tiled_join:
+            # Tiles are joined in their own process pool, which pool workers cannot start, so boundaries run here one at a time
+            tiling.reset_tiles(tile_database_filename)
+            for _ in map(worker_tasks, remaining):
+                pbar.update()
+        else:
+            ppool = manager.Pool(1)
+            for _ in ppool.imap_unordered(worker_tasks, remaining):
+                pbar.update()
+            ppool.close()
+            ppool.join()
+    trace.records.extend(worker_trace.records)
 
     # with sqlite3.connect(':memory:') as conn:
     #     sql.save_db_to_file(conn, database_filename)
 
-    return result
+    # Copy out of the manager so that later stages can add fields to each boundary's results
+    return {id: result[id] for id in sorted(result.keys())}
 
-def overlap_statistics(column, result):
+def overlap_statistics(column, result, level=search_lvl):
+    local_label, global_label, local_gap_label, global_gap_label = result_labels(level)
     with sqlite3.connect(database_filename) as conn:
+        sql.configure_disk_connection(conn, db_cache_mb, db_mmap_mb)
         # Perform spatial queries using SpatiaLite functions
         cursor = conn.cursor()
 
-        for id, (below, above) in tqdm(enumerate(more_itertools.windowed(column, 2)), total=len(column)-1):
-            lowertable = tableName(below[rv.NAME])
-            uppertable = tableName(above[rv.NAME])
-            if id > 0:
-                unionresult = sql.countUnion.format(table1=lowertable, table2=uppertable)
-                cursor.execute(sql.countQuery.format(unionresult))
+        for id, (below, above) in tqdm(enumerate(more_itertools.windowed(column, 2), 1), total=len(column)-1):
+            lowertable = intervalTable(below)
+            uppertable = intervalTable(above)
+            bname = '/'.join((below[rv.NAME], above[rv.NAME]))
+            unionresult = sql.countUnion.format(table1=lowertable, table2=uppertable)
+            trace.execute(cursor, sql.countQuery.format(unionresult), 'overlap_statistics', bname)
+            denom = cursor.fetchone()[0]
+            result[id][local_label + '_pct'] = 0 if denom == 0 else result[id][local_label]/denom
+
+            if count_global_crossings:
+                result[id][global_label + '_pct'] = 0 if denom == 0 else result[id][global_label]/denom
+
+            if find_gappers:
+                unionresult = sql.countUnion.format(table1=lowertable + '_olderview', table2=uppertable + '_youngerview')
+                trace.execute(cursor, sql.countQuery.format(unionresult), 'overlap_statistics', bname)
                 denom = cursor.fetchone()[0]
-                result[id][local_label + '_pct'] = 0 if denom == 0 else result[id][local_label]/denom
+                result[id][local_gap_label + '_pct'] = 0 if denom == 0 else result[id][local_gap_label]/denom
 
                 if count_global_crossings:
-                    result[id][global_label + '_pct'] = 0 if denom == 0 else result[id][global_label]/denom
+                    result[id][global_gap_label + '_pct'] = 0 if denom == 0 else result[id][global_gap_label]/denom
+
+def resample_statistics(column, result, level=search_lvl):
+    '''Add confidence intervals for the local and global _pct results by resampling each boundary's occurrences.
+    Occurrences are read once per table, and replicates run in parallel across boundaries.'''
+    local_label, global_label, _, _ = result_labels(level)
+    print(f'Resampling boundaries ({resample_method}, {resample_replicates} replicates)...')
+    encoded = {}
+    with sqlite3.connect(database_filename) as conn:
+        occurrences = {}
+        for interval in tqdm(column):
+            occurrences[interval[rv.NAME]] = resampling.load_occurrences(conn, intervalTable(interval), taxon_field)
+
+    for id, (below, above) in enumerate(more_itertools.windowed(column, 2), 1):
+        encoded[id] = resampling.encode_boundary(occurrences[below[rv.NAME]], occurrences[above[rv.NAME]], threshold_distance_deg)
+    del occurrences
 
-                if find_gappers:
-                    unionresult = sql.countUnion.format(table1=lowertable + '_olderview', table2=uppertable + '_youngerview')
-                    cursor.execute(sql.countQuery.format(unionresult))
-                    denom = cursor.fetchone()[0]
-                    result[id][local_gap_label + '_pct'] = 0 if denom == 0 else result[id][local_gap_label]/denom
+    intervals = resampling.resample_boundaries(encoded, resample_replicates, resample_method, resample_confidence, resample_size)
+    for id, (local_lo, local_hi, global_lo, global_hi) in intervals.items():
+        result[id][local_label + '_pct_lo'] = local_lo
+        result[id][local_label + '_pct_hi'] = local_hi
+        if count_global_crossings:
+            result[id][global_label + '_pct_lo'] = global_lo
+            result[id][global_label + '_pct_hi'] = global_hi
 
-                    if count_global_crossings:
-                        result[id][global_gap_label + '_pct'] = 0 if denom == 0 else result[id][global_gap_label]/denom
+def boundary_ages(column):
+    '''Age (Ma) of each boundary of column, numbered as in find_bounary_crossers'''
+    return {id: max(float(below[rv.MIN_MA]), float(above[rv.MIN_MA])) for id, (below, above) in enumerate(more_itertools.windowed(column, 2), 1)}
 
-def export_dict_of_dicts_to_csv(data, csv_filename):
+def export_dict_of_dicts_to_csv(data, csv_filename, store_filename=None, settings=None, ages=None):
     # Extract headers from the first dictionary
     headers = list(data[next(iter(data))].keys())
 
@@ -321,6 +556,11 @@ def export_dict_of_dicts_to_csv(data, csv_filename):
             row.update(inner_dict)
             writer.writerow(row)
 
+    # Also keep the run in the result store, where it is not overwritten by runs with other settings.
+    # Written after the CSV so that a store which cannot be written (e.g. locked) does not lose the run's output
+    if store_filename is not None:
+        result_store.append_run(store_filename, settings, data, ages)
+
 def clearProcessedBoundaries(local=True, glob=True, gappers=True):
     with sqlite3.connect(database_filename) as conn:
         cursor = conn.cursor()
@@ -354,7 +594,38 @@ if __name__ == "__main__":
 
     result = find_bounary_crossers(column) # Multiprocess
     overlap_statistics(column, result) # Single process
+    if resample_method is not None:
+        resample_statistics(column, result) # Multiprocess
 
     # Export the dictionary of dictionaries to a CSV file
-    export_dict_of_dicts_to_csv(result, csv_filename)
-    print(f'Results written to: {csv_filename}')
\ No newline at end of file
+    export_dict_of_dicts_to_csv(result, csv_filename, result_store_filename, store_settings(), boundary_ages(column))
+    print(f'Results written to: {csv_filename}')
+
+    if all_levels:
+        try:
+            with open(intervals_filename, 'rb') as f:
+                intervals = pickle.load(f)
+        except FileNotFoundError as err:
+            intervals = queryIntervals()
+            with open(intervals_filename, 'wb') as f:
+                pickle.dump(intervals, f)
+
+        # Finest first. Every level searches the grid tables of the search_lvl intervals, which are only built once
+        for level in reversed([level for level in TimeLevel if level.index() < search_lvl.index()]):
+            coarse_column = level_column(column, intervals, level)
+            if len(coarse_column) < 2:
+                continue
+            create_level_views(coarse_column)
+            level_result = find_bounary_crossers(coarse_column, level)
+            overlap_statistics(coarse_column, level_result, level)
+            if resample_method is not None:
+                resample_statistics(coarse_column, level_result, level)
+
+            level_filename = f'{os.path.splitext(csv_filename)[0]}_{level}{os.path.splitext(csv_filename)[1]}'
+            export_dict_of_dicts_to_csv(level_result, level_filename, result_store_filename, store_settings(level), boundary_ages(coarse_column))
+            print(f'{level.capitalize()} results written to: {level_filename}')
+
+    if trace.enabled:
+        trace_files = trace.write(os.path.splitext(csv_filename)[0])
+        print(f'Profiling trace written to: {", ".join(trace_files)}')
+        trace.summary()
\ No newline at end of file